@@ -227,4 +227,137 @@ SOCIALACCOUNT_EMAIL_REQUIRED = True
 SOCIALACCOUNT_QUERY_EMAIL = True
 
 # Custom OAuth redirect URLs
-OAUTH_REDIRECT_URI = env('OAUTH_REDIRECT_URI', default='http://localhost:3000/auth/callback')
\ No newline at end of file
+OAUTH_REDIRECT_URI = env('OAUTH_REDIRECT_URI', default='http://localhost:3000/auth/callback')
+
+# Torrent streaming settings
+
+TORRENT_LISTEN_INTERFACES = env('TORRENT_LISTEN_INTERFACES', default='0.0.0.0:6881,[::]:6881')
+TORRENT_DHT_BOOTSTRAP_NODES = env(
+    'TORRENT_DHT_BOOTSTRAP_NODES',
+    default='dht.libtorrent.org:25401,router.bittorrent.com:6881,router.utorrent.com:6881,dht.transmissionbt.com:6881',
+)
+TORRENT_CONNECTIONS_LIMIT = env.int('TORRENT_CONNECTIONS_LIMIT', default=400)
+TORRENT_ACTIVE_DOWNLOADS = env.int('TORRENT_ACTIVE_DOWNLOADS', default=20)
+TORRENT_ACTIVE_SEEDS = env.int('TORRENT_ACTIVE_SEEDS', default=20)
+
+# Pieces kept under deadline ahead of the playback position; the window widens
+# with the download rate so it always covers STREAM_LOOKAHEAD_SECONDS of data.
+STREAM_PIECE_WINDOW = env.int('STREAM_PIECE_WINDOW', default=8)
+STREAM_PIECE_WINDOW_MAX = env.int('STREAM_PIECE_WINDOW_MAX', default=64)
+STREAM_LOOKAHEAD_SECONDS = env.int('STREAM_LOOKAHEAD_SECONDS', default=30)
+STREAM_DEADLINE_MS = env.int('STREAM_DEADLINE_MS', default=1000)
+STREAM_DEADLINE_STEP_MS = env.int('STREAM_DEADLINE_STEP_MS', default=250)
+
+# Seconds a request may wait for torrent metadata or for a single piece
+STREAM_METADATA_TIMEOUT = env.int('STREAM_METADATA_TIMEOUT', default=180)
+STREAM_PIECE_TIMEOUT = env.int('STREAM_PIECE_TIMEOUT', default=60)
+
+# Stream initialization runs in the background; a stream is "ready" once the
+# first STREAM_BUFFER_PIECES pieces of the movie are on disk.
+STREAM_INIT_WORKERS = env.int('STREAM_INIT_WORKERS', default=8)
+STREAM_BUFFER_PIECES = env.int('STREAM_BUFFER_PIECES', default=4)
+
+# Largest byte span served by a single torrent range response
+STREAM_MAX_RESPONSE_SPAN = env.int('STREAM_MAX_RESPONSE_SPAN', default=64 * 1024 * 1024)
+
+# Resume data and the stream registry are kept here so active streams come
+# back after a restart without re-fetching metadata or re-checking pieces.
+STREAM_STATE_DIR = env('STREAM_STATE_DIR', default=str(BASE_DIR / '_StreamState'))
+STREAM_RESUME_SAVE_INTERVAL = env.int('STREAM_RESUME_SAVE_INTERVAL', default=60)
+STREAM_AUTOSTART = env.bool('STREAM_AUTOSTART', default=True)
+
+# Idle streams are paused, then removed from the session and the registry.
+# At most STREAM_MAX_ACTIVE streams are kept; the least recently read goes first.
+STREAM_IDLE_PAUSE_SECONDS = env.int('STREAM_IDLE_PAUSE_SECONDS', default=10 * 60)
+STREAM_IDLE_REMOVE_SECONDS = env.int('STREAM_IDLE_REMOVE_SECONDS', default=2 * 60 * 60)
+STREAM_MAX_ACTIVE = env.int('STREAM_MAX_ACTIVE', default=20)
+STREAM_REAP_INTERVAL = env.int('STREAM_REAP_INTERVAL', default=60)
+
+# Disk budget for downloaded titles. Once usage passes the high watermark the
+# least recently watched titles without active readers are evicted until usage
+# drops below the low watermark.
+STREAM_DISK_BUDGET = env.int('STREAM_DISK_BUDGET', default=50 * 1024 ** 3)
+STREAM_DISK_HIGH_WATERMARK = env.float('STREAM_DISK_HIGH_WATERMARK', default=0.9)
+STREAM_DISK_LOW_WATERMARK = env.float('STREAM_DISK_LOW_WATERMARK', default=0.75)
+STREAM_DISK_CACHE_INTERVAL = env.int('STREAM_DISK_CACHE_INTERVAL', default=5 * 60)
+
+# Periodic maintenance jobs share one scheduler thread; each run is delayed by
+# up to +/- STREAM_MAINTENANCE_JITTER of its interval.
+STREAM_MAINTENANCE_JITTER = env.float('STREAM_MAINTENANCE_JITTER', default=0.1)
+STREAM_STATS_INTERVAL = env.int('STREAM_STATS_INTERVAL', default=5 * 60)
+
+# Media info (duration, streams, codecs) is probed once per file in the
+# background. Conversions wait up to STREAM_PROBE_WAIT seconds for a probe
+# that is still running.
+STREAM_PROBE_WORKERS = env.int('STREAM_PROBE_WORKERS', default=2)
+STREAM_PROBE_TIMEOUT = env.int('STREAM_PROBE_TIMEOUT', default=60)
+STREAM_PROBE_WAIT = env.int('STREAM_PROBE_WAIT', default=10)
+
+# Completed video files also get a keyframe seek index from one packet scan.
+STREAM_SEEK_INDEX_TIMEOUT = env.int('STREAM_SEEK_INDEX_TIMEOUT', default=10 * 60)
+
+# HLS transcoding: one encoder per title writes STREAM_HLS_SEGMENT_SECONDS
+# segments into the title's directory under _Movies/.derived. Requests more than STREAM_HLS_MAX_AHEAD segments
+# ahead of the encoder restart it at the requested segment.
+STREAM_HLS_SEGMENT_SECONDS = env.int('STREAM_HLS_SEGMENT_SECONDS', default=6)
+STREAM_HLS_MAX_AHEAD = env.int('STREAM_HLS_MAX_AHEAD', default=3)
+STREAM_HLS_SEGMENT_TIMEOUT = env.int('STREAM_HLS_SEGMENT_TIMEOUT', default=60)
+STREAM_HLS_IDLE_SECONDS = env.int('STREAM_HLS_IDLE_SECONDS', default=2 * 60)
+
+# Every ffmpeg process goes through one supervisor: at most
+# STREAM_TRANSCODE_MAX_PROCESSES run at once, the rest queue (viewers first)
+# for up to STREAM_TRANSCODE_QUEUE_TIMEOUT seconds. Processes running longer
+# than their timeout are killed.
+STREAM_TRANSCODE_MAX_PROCESSES = env.int('STREAM_TRANSCODE_MAX_PROCESSES', default=4)
+STREAM_TRANSCODE_THREADS = env.int('STREAM_TRANSCODE_THREADS', default=2)
+STREAM_TRANSCODE_QUEUE_TIMEOUT = env.int('STREAM_TRANSCODE_QUEUE_TIMEOUT', default=30)
+STREAM_TRANSCODE_TIMEOUT = env.int('STREAM_TRANSCODE_TIMEOUT', default=4 * 60 * 60)
+STREAM_TRANSCODE_CHUNK_TIMEOUT = env.int('STREAM_TRANSCODE_CHUNK_TIMEOUT', default=60)
+STREAM_TRANSCODE_LOG_LINES = env.int('STREAM_TRANSCODE_LOG_LINES', default=20)
+
+# Converted titles are cached as MP4 under _Movies/.derived. Range requests past
+# what has been converted so far wait up to STREAM_CONVERSION_WAIT seconds.
+# Conversions that are not running are forgotten after STREAM_CONVERSION_IDLE_SECONDS
+# without requests; a failed one is only retried after that.
+STREAM_CONVERSION_WAIT = env.int('STREAM_CONVERSION_WAIT', default=30)
+STREAM_CONVERSION_CACHE = env.bool('STREAM_CONVERSION_CACHE', default=True)
+STREAM_CONVERSION_IDLE_SECONDS = env.int('STREAM_CONVERSION_IDLE_SECONDS', default=10 * 60)
+
+# Viewers of a title share one encoder and read its output from a ring buffer
+# of this size; readers that fall further behind read the cache file instead.
+STREAM_BROADCAST_BUFFER = env.int('STREAM_BROADCAST_BUFFER', default=32 * 1024 * 1024)
+
+# How complete stored files are served: 'python' copies them through the
+# worker, 'sendfile' hands the range to the server's wsgi.file_wrapper
+# (os.sendfile under gunicorn), 'x-accel' and 'x-sendfile' leave the file and
+# its Range handling to nginx / Apache. X-Accel-Redirect locations are built
+# from STREAM_SENDFILE_PREFIX plus the path relative to STREAM_SENDFILE_ROOT.
+STREAM_SENDFILE_MODE = env('STREAM_SENDFILE_MODE', default='sendfile')
+STREAM_SENDFILE_ROOT = env('STREAM_SENDFILE_ROOT', default='./_Movies')
+STREAM_SENDFILE_PREFIX = env('STREAM_SENDFILE_PREFIX', default='/protected/movies/')
+STREAM_SENDFILE_READAHEAD = env.int('STREAM_SENDFILE_READAHEAD', default=4 * 1024 * 1024)
+
+# Unix socket of the stream daemon (manage.py streamd). When set, the torrent
+# session, the stream registry and the encoders live in the daemon and web
+# workers forward stream requests to it, so the web tier can run several
+# worker processes.
+STREAM_DAEMON_SOCKET = env('STREAM_DAEMON_SOCKET', default='')
+
+# At stream start the first and last pieces of the file, plus the pieces of
+# its index (MP4 moov, Matroska Cues), are downloaded before anything else.
+# Indexes larger than this are only pinned up to this many bytes.
+STREAM_INDEX_MAX_BYTES = env.int('STREAM_INDEX_MAX_BYTES', default=16 * 1024 * 1024)
+
+# Finished MP4 downloads with moov at the end are remuxed (stream copy, moov
+# first) into the title's directory under _Movies/.derived; stored movies are then served
+# from that copy. At most this many remuxes run at once on a host.
+STREAM_FASTSTART_MAX_JOBS = env.int('STREAM_FASTSTART_MAX_JOBS', default=1)
+
+# Pieces read for torrent responses stay in memory up to this many bytes, so
+# viewers of the same title are served without going back to libtorrent.
+STREAM_PIECE_CACHE_BYTES = env.int('STREAM_PIECE_CACHE_BYTES', default=256 * 1024 * 1024)
+
+# .torrent downloads give up after this many seconds. Their metadata, and
+# metadata fetched from peers for magnets, is kept by info hash under
+# STREAM_STATE_DIR/metadata, so later adds of the same torrent skip the fetch.
+STREAM_TORRENT_DOWNLOAD_TIMEOUT = env.int('STREAM_TORRENT_DOWNLOAD_TIMEOUT', default=30)
@@ -5,7 +5,11 @@ until python manage.py migrate; do
 done
 
 bash create_superuser.sh
-python manage.py runserver 0.0.0.0:8000
+if [ -n "$STREAM_DAEMON_SOCKET" ]; then
+  # Torrents and encoders live in the daemon, so uvicorn may run WEB_CONCURRENCY workers.
+  python manage.py streamd &
+fi
+uvicorn backend.asgi:application --host 0.0.0.0 --port 8000
 
 
 
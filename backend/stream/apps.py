@@ -1,6 +1,38 @@
+import os
+import signal
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+SERVER_COMMANDS = ('gunicorn', 'uvicorn', 'daphne')
+
+
+def is_server_process():
+    if 'runserver' in sys.argv:
+        # Only the autoreloader's child actually serves requests.
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    return any(name in os.path.basename(sys.argv[0]) for name in SERVER_COMMANDS)
 
 
 class StreamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stream'
+
+    def ready(self):
+        # With a stream daemon, web workers only forward stream requests to it.
+        if not settings.STREAM_AUTOSTART or not is_server_process() or settings.STREAM_DAEMON_SOCKET:
+            return
+        start_stream_services()
+
+
+def start_stream_services():
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        # Exit through atexit so resume data and the registry are flushed.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    from .services.maintenance import start_maintenance
+    from .services.registry import get_stream_registry
+    get_stream_registry().restore()
+    start_maintenance()
@@ -0,0 +1,22 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stream.apps import start_stream_services
+from stream import views  # noqa: F401 - registers the views the daemon serves
+from stream.services.daemon import StreamDaemon
+
+
+class Command(BaseCommand):
+    help = 'Runs the torrent session and stream registry that web workers forward stream requests to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.STREAM_DAEMON_SOCKET,
+                            help='Unix socket to listen on (default: STREAM_DAEMON_SOCKET).')
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError('Set STREAM_DAEMON_SOCKET or pass --socket.')
+        start_stream_services()
+        asyncio.run(StreamDaemon(options['socket']).serve())
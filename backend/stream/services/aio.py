@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+_done = object()
+
+
+class Signal(threading.Event):
+    """threading.Event that coroutines can await without holding a thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.futures = set()
+        self.futures_lock = threading.Lock()
+
+    def set(self):
+        super().set()
+        with self.futures_lock:
+            futures = list(self.futures)
+        for loop, future in futures:
+            loop.call_soon_threadsafe(self.wake, future)
+
+    @staticmethod
+    def wake(future):
+        if not future.done():
+            future.set_result(True)
+
+    async def wait_async(self, timeout=None):
+        if self.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        entry = (loop, loop.create_future())
+        with self.futures_lock:
+            self.futures.add(entry)
+        try:
+            # set() may have run before the future was registered.
+            if not self.is_set():
+                await asyncio.wait_for(entry[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.futures_lock:
+                self.futures.discard(entry)
+
+
+async def iterate_in_thread(iterator):
+    # Serves a blocking iterator to an async response one chunk at a time, so a
+    # thread is only held while a chunk is being produced.
+    iterator = iter(iterator)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, _done)
+            if chunk is _done:
+                return
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            await asyncio.to_thread(iterator.close)
+
+
+def stream_async(response):
+    # ASGI servers would otherwise collect a blocking streaming body into memory before sending it.
+    if getattr(response, 'streaming', False) and not response.is_async:
+        response.streaming_content = iterate_in_thread(response.streaming_content)
+    return response
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+import libtorrent as lt
+from django.conf import settings
+
+from .aio import Signal
+from .piece_cache import PieceCache
+
+
+def handle_key(handle):
+    # Hybrid torrents report a v2 hash once metadata arrives; keep keying on v1
+    # so the key matches the one known from the magnet link.
+    hashes = handle.info_hashes()
+    return str(hashes.v1 if hashes.has_v1() else hashes.get_best())
+
+
+class PieceWaiter:
+
+    def __init__(self):
+        self.event = Signal()
+        self.value = None
+        self.error = None
+        self.refs = 0
+
+
+class AlertDispatcher:
+    """Single consumer of session alerts that wakes the requests waiting on them."""
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.waiters = {}
+        self.listeners = defaultdict(list)
+        self.pieces = PieceCache(settings.STREAM_PIECE_CACHE_BYTES)
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name='torrent-alerts', daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=2)
+
+    def subscribe(self, alert_type, callback):
+        self.listeners[alert_type].append(callback)
+
+    def run(self):
+        while self.running:
+            if self.session.wait_for_alert(500) is None:
+                continue
+            for alert in self.session.pop_alerts():
+                try:
+                    self.dispatch(alert)
+                except Exception as e:
+                    print(f"[Alerts] Failed to handle {type(alert).__name__}: {e}")
+
+    def dispatch(self, alert):
+        if isinstance(alert, lt.metadata_received_alert):
+            self.resolve(('metadata', handle_key(alert.handle)))
+        elif isinstance(alert, lt.piece_finished_alert):
+            self.resolve(('piece', handle_key(alert.handle), alert.piece_index))
+        elif isinstance(alert, lt.read_piece_alert):
+            key = ('read', handle_key(alert.handle), alert.piece)
+            if alert.error.value():
+                self.resolve(key, error=alert.error.message())
+            else:
+                # Every piece read for a response is kept for the next reader of it.
+                piece = alert.buffer
+                self.pieces.put(key[1:], piece)
+                self.resolve(key, value=memoryview(piece))
+        elif isinstance(alert, (lt.torrent_error_alert, lt.metadata_failed_alert)):
+            print(f"[Alerts] {alert.message()}")
+        for callback in self.listeners[type(alert)]:
+            callback(alert)
+
+    def resolve(self, key, value=None, error=None):
+        with self.lock:
+            waiter = self.waiters.get(key)
+        if waiter is not None:
+            waiter.value = value
+            waiter.error = error
+            waiter.event.set()
+
+    def wait(self, key, ready, timeout, start=None):
+        if ready():
+            return None
+        with self.lock:
+            waiter = self.waiters.setdefault(key, PieceWaiter())
+            waiter.refs += 1
+        try:
+            if start:
+                start()
+            # The alert may have been handled before the waiter was registered.
+            if not ready() and not waiter.event.wait(timeout):
+                raise TimeoutError(f"Timed out after {timeout}s waiting for {key[0]} of {key[1]}")
+            if waiter.error:
+                raise IOError(waiter.error)
+            return waiter.value
+        finally:
+            with self.lock:
+                waiter.refs -= 1
+                if waiter.refs == 0:
+                    self.waiters.pop(key, None)
+
+    async def wait_async(self, key, ready, timeout, start=None):
+        # Same as wait(), for coroutines: the alert thread wakes them through their event loop.
+        # ready() and start() call into libtorrent, which blocks on its network thread, so they
+        # run in worker threads; ready=None never is.
+        if ready is not None and await asyncio.to_thread(ready):
+            return None
+        with self.lock:
+            waiter = self.waiters.setdefault(key, PieceWaiter())
+            waiter.refs += 1
+        try:
+            if start:
+                await asyncio.to_thread(start)
+            ready_now = ready is not None and await asyncio.to_thread(ready)
+            if not ready_now and not await waiter.event.wait_async(timeout):
+                raise TimeoutError(f"Timed out after {timeout}s waiting for {key[0]} of {key[1]}")
+            if waiter.error:
+                raise IOError(waiter.error)
+            return waiter.value
+        finally:
+            with self.lock:
+                waiter.refs -= 1
+                if waiter.refs == 0:
+                    self.waiters.pop(key, None)
+
+    def wait_for_metadata(self, handle, timeout):
+        key = ('metadata', handle_key(handle))
+        self.wait(key, lambda: handle.status().has_metadata, timeout)
+
+    def wait_for_piece(self, handle, piece_index, timeout):
+        key = ('piece', handle_key(handle), piece_index)
+        self.wait(key, lambda: handle.have_piece(piece_index), timeout)
+
+    def read_piece(self, handle, piece_index, timeout):
+        key = ('read', handle_key(handle), piece_index)
+        piece = self.pieces.get(key[1:])
+        if piece is not None:
+            return piece
+        return self.wait(key, lambda: False, timeout, start=lambda: handle.read_piece(piece_index))
+
+    async def wait_for_piece_async(self, handle, piece_index, timeout):
+        key = ('piece', await asyncio.to_thread(handle_key, handle), piece_index)
+        await self.wait_async(key, lambda: handle.have_piece(piece_index), timeout)
+
+    async def read_piece_async(self, handle, piece_index, timeout):
+        key = ('read', await asyncio.to_thread(handle_key, handle), piece_index)
+        piece = self.pieces.get(key[1:])
+        if piece is not None:
+            return piece
+        return await self.wait_async(key, None, timeout, start=lambda: handle.read_piece(piece_index))
@@ -0,0 +1,233 @@
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .media import get_media_store
+from .session import get_session_manager
+
+SAVE_PATH = './_Movies'
+# Conversions, remuxes and HLS segments, one directory per title they were made from.
+DERIVED_DIR = '.derived'
+
+
+def disk_usage(path):
+    # Allocated bytes rather than st_size: torrent files are sparse until complete.
+    if os.path.isfile(path):
+        return os.stat(path).st_blocks * 512
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def files_under(path):
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(root, name) for root, dirs, files in os.walk(path) for name in files]
+
+
+class DiskCache:
+    """Size-budgeted LRU index of the titles stored under SAVE_PATH."""
+
+    def __init__(self, root=None):
+        self.root = root or SAVE_PATH
+        self.index_path = os.path.join(settings.STREAM_STATE_DIR, 'disk_cache.json')
+        self.budget = settings.STREAM_DISK_BUDGET
+        self.high_watermark = int(self.budget * settings.STREAM_DISK_HIGH_WATERMARK)
+        self.low_watermark = int(self.budget * settings.STREAM_DISK_LOW_WATERMARK)
+        self.entries = {}
+        self.pins = Counter()
+        self.counters = Counter()
+        self.lock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(settings.STREAM_STATE_DIR, exist_ok=True)
+        if not self.load():
+            self.scan()
+
+    def title_of(self, path):
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        if relative.startswith('..'):
+            return None
+        parts = relative.split(os.sep)
+        if parts[0] == DERIVED_DIR:
+            return parts[1] if len(parts) > 1 else None
+        return parts[0]
+
+    def derived_path(self, path, *names):
+        # Output made from a title is accounted for, pinned and evicted with it.
+        title = self.title_of(path)
+        if title is None:
+            return os.path.join(os.path.dirname(path), DERIVED_DIR, *names)
+        return os.path.join(self.root, DERIVED_DIR, title, *names)
+
+    def title_paths(self, title):
+        return [os.path.join(self.root, title), os.path.join(self.root, DERIVED_DIR, title)]
+
+    def measure(self, title):
+        return sum(disk_usage(path) for path in self.title_paths(title) if os.path.exists(path))
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                self.entries = json.load(f)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def scan(self):
+        # Only run when there is no index yet; afterwards the index is kept up to date.
+        for title in os.listdir(self.root):
+            if title == DERIVED_DIR:
+                continue
+            stat = os.stat(os.path.join(self.root, title))
+            self.entries[title] = {'size': self.measure(title), 'last_access': max(stat.st_atime, stat.st_mtime)}
+        print(f"[DiskCache] Indexed {len(self.entries)} title(s) in {self.root}")
+        self.save()
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries)
+        with open(f"{self.index_path}.tmp", 'w') as f:
+            f.write(data)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+
+    def touch(self, path, expected_size=None, info_hash=None):
+        title = self.title_of(path)
+        if title is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(title)
+            if entry is None:
+                self.counters['misses'] += 1
+                entry = self.entries[title] = {'size': self.measure(title)}
+            else:
+                self.counters['hits'] += 1
+            entry['last_access'] = time.time()
+            if expected_size is not None:
+                entry['size'] = max(entry['size'], expected_size)
+            if info_hash is not None:
+                # Its resume data goes with the title when it is evicted.
+                entry['info_hash'] = info_hash
+        return title
+
+    def pin(self, path, expected_size=None, info_hash=None):
+        title = self.touch(path, expected_size, info_hash)
+        if title is not None:
+            with self.lock:
+                self.pins[title] += 1
+        return title
+
+    def unpin(self, title):
+        with self.lock:
+            self.pins[title] -= 1
+            released = self.pins[title] <= 0
+            if released:
+                del self.pins[title]
+            if title in self.entries:
+                self.entries[title]['last_access'] = time.time()
+        if released:
+            # Whatever was written for the title while it was pinned is counted from now on.
+            self.refresh(title)
+
+    def refresh(self, title):
+        # Sizes are measured when a title changes, not by rescanning the whole cache.
+        size = self.measure(title)
+        with self.lock:
+            entry = self.entries.get(title)
+            if entry is not None:
+                # Torrents being downloaded are sparse; they keep their expected size.
+                entry['size'] = max(entry['size'], size) if title in self.pins else size
+
+    def total_size(self):
+        with self.lock:
+            return sum(entry['size'] for entry in self.entries.values())
+
+    def enforce(self):
+        if self.total_size() <= self.high_watermark:
+            return 0
+        # Over the watermark, the candidates are measured again before any of them is chosen.
+        with self.lock:
+            candidates = [title for title in self.entries if title not in self.pins]
+        for title in candidates:
+            self.refresh(title)
+        with self.lock:
+            total = self.total_size()
+            if total <= self.high_watermark:
+                return 0
+            candidates = sorted((entry['last_access'], title) for title, entry in self.entries.items()
+                                if title not in self.pins)
+            victims = []
+            for last_access, title in candidates:
+                if total <= self.low_watermark:
+                    break
+                total -= self.entries[title]['size']
+                victims.append((title, dict(self.entries[title])))
+        evicted = 0
+        for title, entry in victims:
+            # Titles that could not be deleted stay indexed and are measured again next time.
+            if self.evict(title, entry):
+                with self.lock:
+                    self.entries.pop(title, None)
+                evicted += 1
+        return evicted
+
+    def evict(self, title, entry):
+        media = get_media_store()
+        for path in self.title_paths(title):
+            for file_path in files_under(path):
+                media.forget(file_path)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"[DiskCache] Failed to evict {path}: {e}")
+                return False
+        if entry.get('info_hash'):
+            get_session_manager().delete_resume_data(entry['info_hash'])
+        self.counters['evictions'] += 1
+        self.counters['evicted_bytes'] += entry['size']
+        print(f"[DiskCache] Evicted {title} ({entry['size']} bytes)")
+        return True
+
+    def maintain(self):
+        self.enforce()
+        self.save()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'titles': len(self.entries),
+                'pinned': len(self.pins),
+                'size': self.total_size(),
+                'budget': self.budget,
+                'hits': self.counters['hits'],
+                'misses': self.counters['misses'],
+                'evictions': self.counters['evictions'],
+                'evicted_bytes': self.counters['evicted_bytes'],
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskCache()
+                atexit.register(_cache.save)
+    return _cache
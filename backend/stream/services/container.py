@@ -0,0 +1,154 @@
+# Parsers only see the file through read(position, size), so they also work on
+# a torrent that is still downloading: each read waits for the pieces it needs.
+
+# Matroska / WebM element ids, with their length marker bits.
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+CUES = 0x1C53BB6B
+CLUSTER = 0x1F43B675
+
+MAX_TOP_LEVEL_BOXES = 64
+MAX_SEGMENT_CHILDREN = 8
+
+
+def container_type(head):
+    if len(head) >= 8 and head[4:8] == b'ftyp':
+        return 'mp4'
+    if head[:4] == EBML_HEADER.to_bytes(4, 'big'):
+        return 'matroska'
+    return None
+
+
+def index_ranges(read, file_size):
+    # Byte ranges [start, end) of the container's index, or [] when it is unknown.
+    kind = container_type(read(0, 16))
+    try:
+        if kind == 'mp4':
+            return mp4_index_ranges(read, file_size)
+        if kind == 'matroska':
+            return matroska_index_ranges(read, file_size)
+    except ValueError as e:
+        print(f"[Container] Could not parse {kind} structure: {e}")
+    return []
+
+
+def mp4_boxes(read, file_size):
+    # (type, position, size) of the top-level boxes, hopping from header to header.
+    position = 0
+    for _ in range(MAX_TOP_LEVEL_BOXES):
+        if position + 8 > file_size:
+            return
+        header = read(position, 16)
+        if len(header) < 8:
+            return
+        size = int.from_bytes(header[:4], 'big')
+        box_type = header[4:8]
+        if size == 1:
+            if len(header) < 16:
+                return
+            size = int.from_bytes(header[8:16], 'big')
+        elif size == 0:
+            size = file_size - position
+        if size < 8:
+            raise ValueError(f"box of {size} bytes at {position}")
+        yield box_type, position, min(size, file_size - position)
+        position += size
+
+
+def mp4_index_ranges(read, file_size):
+    # Usually ftyp, mdat, then moov at the end.
+    for box_type, position, size in mp4_boxes(read, file_size):
+        if box_type == b'moov':
+            return [(position, position + size)]
+    return []
+
+
+def mp4_moov_at_end(read, file_size):
+    # True when players have to fetch the end of the file before the first frame.
+    if container_type(read(0, 16)) != 'mp4':
+        return False
+    try:
+        types = [box_type for box_type, _, _ in mp4_boxes(read, file_size)]
+    except ValueError:
+        return False
+    return b'moov' in types and b'mdat' in types and types.index(b'mdat') < types.index(b'moov')
+
+
+def read_vint(data, offset, keep_marker=False):
+    # EBML variable-length integer: the position of the first set bit gives the length.
+    if offset >= len(data):
+        raise ValueError(f"truncated element at {offset}")
+    first = data[offset]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or offset + length > len(data):
+        raise ValueError(f"invalid variable-length integer at {offset}")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def read_element_header(read, position):
+    # (id, size or None when unknown, header length) of the element at position.
+    data = read(position, 12)
+    element_id, id_length, _ = read_vint(data, 0, keep_marker=True)
+    size, size_length, unknown = read_vint(data, id_length)
+    return element_id, None if unknown else size, id_length + size_length
+
+
+def matroska_index_ranges(read, file_size):
+    # The SeekHead at the start of the Segment points at the Cues element.
+    element_id, size, header_length = read_element_header(read, 0)
+    if element_id != EBML_HEADER or size is None:
+        raise ValueError('missing EBML header')
+    position = header_length + size
+    element_id, _, header_length = read_element_header(read, position)
+    if element_id != SEGMENT:
+        raise ValueError('missing Segment')
+    segment_start = position + header_length
+
+    position = segment_start
+    for _ in range(MAX_SEGMENT_CHILDREN):
+        element_id, size, header_length = read_element_header(read, position)
+        if element_id == CLUSTER or size is None:
+            break
+        if element_id == SEEK_HEAD:
+            cues = seek_position(read(position + header_length, min(size, 64 * 1024)), CUES)
+            if cues is None:
+                break
+            cues_start = segment_start + cues
+            element_id, size, header_length = read_element_header(read, cues_start)
+            if element_id != CUES or size is None:
+                raise ValueError(f"SeekHead points at {element_id:#x} instead of Cues")
+            return [(cues_start, min(cues_start + header_length + size, file_size))]
+        position += header_length + size
+    return []
+
+
+def seek_position(data, wanted_id):
+    # SeekPosition of the Seek entry for wanted_id, relative to the Segment data.
+    offset = 0
+    while offset < len(data):
+        element_id, id_length, _ = read_vint(data, offset, keep_marker=True)
+        size, size_length, _ = read_vint(data, offset + id_length)
+        body = data[offset + id_length + size_length:offset + id_length + size_length + size]
+        if element_id == SEEK:
+            entry = {}
+            child = 0
+            while child < len(body):
+                child_id, child_id_length, _ = read_vint(body, child, keep_marker=True)
+                child_size, child_size_length, _ = read_vint(body, child + child_id_length)
+                start = child + child_id_length + child_size_length
+                entry[child_id] = body[start:start + child_size]
+                child = start + child_size
+            if int.from_bytes(entry.get(SEEK_ID, b''), 'big') == wanted_id and SEEK_POSITION in entry:
+                return int.from_bytes(entry[SEEK_POSITION], 'big')
+        offset += id_length + size_length + size
+    return None
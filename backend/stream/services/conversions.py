@@ -0,0 +1,308 @@
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+
+from .cache import get_disk_cache
+from .media import get_media_store
+from .transcode import get_transcode_supervisor
+
+
+class Broadcast:
+    """Bounded ring buffer of one encoder's output, read by each client at its own position."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray()
+        self.start = 0
+        self.end = 0
+        self.closed = False
+        self.header = bytearray()
+        self.fragments = deque()
+        self.next_box = 0
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        with self.condition:
+            self.buffer += data
+            self.end += len(data)
+            self.scan_boxes()
+            if len(self.buffer) > self.capacity:
+                trim = len(self.buffer) - self.capacity
+                del self.buffer[:trim]
+                self.start += trim
+                while self.fragments and self.fragments[0] < self.start:
+                    self.fragments.popleft()
+            self.condition.notify_all()
+
+    def scan_boxes(self):
+        # Tracks top-level MP4 boxes: ftyp and moov make up the header, each moof starts a fragment.
+        while self.next_box is not None and self.next_box + 16 <= self.end:
+            offset = self.next_box - self.start
+            if offset < 0:
+                # A single box outgrew the buffer; fragment boundaries are lost from here on.
+                self.next_box = None
+                return
+            size = int.from_bytes(self.buffer[offset:offset + 4], 'big')
+            box_type = bytes(self.buffer[offset + 4:offset + 8])
+            if size == 1:
+                size = int.from_bytes(self.buffer[offset + 8:offset + 16], 'big')
+            if size < 8:
+                self.next_box = None
+                return
+            if box_type in (b'ftyp', b'moov'):
+                if self.next_box + size > self.end:
+                    return
+                self.header += self.buffer[offset:offset + size]
+            elif box_type == b'moof':
+                self.fragments.append(self.next_box)
+            self.next_box += size
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def wait_for(self, position, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.end > position or self.closed, timeout)
+
+    def read(self, position, size, timeout):
+        # None when the position has already left the buffer; b'' at the end of the output.
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.end > position or self.closed, timeout):
+                raise TimeoutError(f"Timed out after {timeout}s waiting for the encoder")
+            if position < self.start:
+                return None
+            offset = position - self.start
+            return bytes(self.buffer[offset:offset + size])
+
+    def live_position(self):
+        # Late joiners without history start at the newest fragment still in the buffer.
+        with self.condition:
+            return self.fragments[-1] if self.fragments else None
+
+
+class Conversion:
+    """A title converted once to MP4 by a single encoder shared by all of its viewers."""
+
+    def __init__(self, movie_path, plan, codec_args):
+        self.movie_path = movie_path
+        self.plan = plan
+        self.codec_args = codec_args
+        self.cached = settings.STREAM_CONVERSION_CACHE
+        directory = get_disk_cache().derived_path(movie_path, 'converted')
+        self.path = os.path.join(directory, f"{Path(movie_path).stem}.{plan}.mp4")
+        self.partial_path = f"{self.path}.partial"
+        self.job = None
+        self.broadcast = None
+        self.pump = None
+        self.writing = False
+        self.cache_title = None
+        self.error = None
+        self.last_access = time.monotonic()
+        # Held while starting, so on_exit sees the pump of a fast exit; reentrant because a
+        # launch that fails runs on_exit from within submit().
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def complete(self):
+        # A cached conversion older than its source is stale.
+        try:
+            return os.path.getmtime(self.path) >= os.path.getmtime(self.movie_path)
+        except OSError:
+            return False
+
+    def running(self):
+        # Stays true until the partial file has been renamed, not just until ffmpeg exits.
+        return self.writing
+
+    def start(self):
+        # Fragmented with the moov first, so the bytes written so far are already playable
+        # and the finished file is byte-identical to what partial readers were served.
+        cmd = [
+            'ffmpeg', '-v', 'error',
+            '-i', self.movie_path,
+            *self.codec_args,
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4',
+            'pipe:1',
+        ]
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.writing = True
+        # The output keeps growing until the encoder exits; it must not be evicted under it.
+        self.cache_title = get_disk_cache().pin(self.movie_path)
+        self.broadcast = Broadcast(settings.STREAM_BROADCAST_BUFFER)
+        self.pump = None
+        with self.lock:
+            self.job = get_transcode_supervisor().submit(cmd, name=f"conversion of {self.movie_path}",
+                                                         stdout=subprocess.PIPE, on_exit=self.on_exit)
+            if not self.writing:
+                # ffmpeg could not be started at all; on_exit has already cleaned up.
+                return
+            self.pump = threading.Thread(target=self.copy_output, args=(self.job, self.broadcast),
+                                         name='conversion-pump', daemon=True)
+            self.pump.start()
+        print(f"====> Converting {self.movie_path} ({self.plan}) into {self.path}")
+
+    def copy_output(self, job, broadcast):
+        # The cache file is written before the ring buffer, so whatever a reader
+        # has seen in the buffer can also be found in the file later.
+        output = open(self.partial_path, 'wb') if self.cached else None
+        try:
+            job.started.wait()
+            while job.stdout is not None:
+                data = job.stdout.read1(256 * 1024)
+                if not data:
+                    break
+                if output:
+                    output.write(data)
+                    output.flush()
+                broadcast.write(data)
+        finally:
+            if output:
+                output.close()
+            broadcast.close()
+
+    def on_exit(self, job):
+        with self.lock:
+            pump = self.pump
+        if pump is not None:
+            pump.join()
+        else:
+            # Nothing was started to close the buffer.
+            self.broadcast.close()
+        try:
+            if job.returncode != 0:
+                self.error = f"ffmpeg exited with {job.returncode}"
+                if self.cached and os.path.exists(self.partial_path):
+                    os.remove(self.partial_path)
+            elif self.cached:
+                os.replace(self.partial_path, self.path)
+                get_media_store().schedule(self.path)
+                print(f"====> Conversion finished: {self.path}")
+        finally:
+            self.writing = False
+            if self.cache_title is not None:
+                get_disk_cache().unpin(self.cache_title)
+                self.cache_title = None
+            if self.cached:
+                # Readers continue from the finished file.
+                self.broadcast = None
+
+    def available(self):
+        # Bytes that can be served right now.
+        broadcast = self.broadcast
+        if broadcast is not None:
+            return broadcast.end
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def wait_for(self, position, timeout):
+        broadcast = self.broadcast
+        if broadcast is not None and not broadcast.wait_for(position, timeout):
+            raise TimeoutError(f"Timed out after {timeout}s waiting for byte {position} of the conversion")
+        if self.available() <= position:
+            raise IOError(f"Conversion of {self.movie_path} has no byte {position}")
+
+    def read(self, start, end=None, chunk_size=256 * 1024):
+        # Live readers are served from the ring buffer; readers that fell behind it,
+        # or that come after the encoder has finished, read the cache file.
+        position = start
+        f = None
+        try:
+            while end is None or position <= end:
+                size = chunk_size if end is None else min(chunk_size, end - position + 1)
+                broadcast = self.broadcast
+                data = None
+                if broadcast is not None:
+                    data = broadcast.read(position, size, settings.STREAM_CONVERSION_WAIT)
+                if data is None or (not data and self.cached):
+                    if not self.cached:
+                        print(f"====> Reader at byte {position} fell behind the conversion buffer")
+                        return
+                    if f is None:
+                        f = open(self.partial_path if os.path.exists(self.partial_path) else self.path, 'rb')
+                    f.seek(position)
+                    data = f.read(size)
+                if not data:
+                    return
+                position += len(data)
+                yield data
+        finally:
+            if f is not None:
+                f.close()
+
+    def join_live(self):
+        # Without a cache file there is no history: send the header, then
+        # continue from the newest fragment boundary.
+        broadcast = self.broadcast
+        if broadcast is None or not broadcast.wait_for(0, settings.STREAM_CONVERSION_WAIT):
+            return
+        position = broadcast.live_position()
+        if position is None:
+            yield from self.read(0)
+            return
+        yield bytes(broadcast.header)
+        yield from self.read(position)
+
+
+class ConversionCache:
+    """Conversions by title and plan; each title has at most one encoder at a time."""
+
+    def __init__(self):
+        self.conversions = {}
+        self.lock = threading.Lock()
+
+    def get(self, movie_path, plan, codec_args):
+        key = (os.path.abspath(movie_path), plan)
+        with self.lock:
+            conversion = self.conversions.get(key)
+            if conversion is None:
+                conversion = self.conversions[key] = Conversion(movie_path, plan, codec_args)
+            conversion.last_access = time.monotonic()
+            if conversion.error:
+                # Not retried until reaped; a broken source would fail again on every request.
+                raise IOError(f"Conversion of {movie_path} failed: {conversion.error}")
+            if not conversion.complete() and not conversion.running():
+                conversion.start()
+        return conversion
+
+    def reap(self):
+        # Finished, failed and unused conversions are forgotten once idle; their files
+        # stay with the title in the disk cache, and failed ones may be retried.
+        with self.lock:
+            for key, conversion in list(self.conversions.items()):
+                idle = time.monotonic() - conversion.last_access
+                if not conversion.running() and idle >= settings.STREAM_CONVERSION_IDLE_SECONDS:
+                    del self.conversions[key]
+
+    def stats(self):
+        with self.lock:
+            return [{
+                'movie_path': conversion.movie_path,
+                'plan': conversion.plan,
+                'complete': conversion.complete(),
+                'running': conversion.running(),
+                'available': conversion.available(),
+            } for conversion in self.conversions.values()]
+
+
+_conversions = None
+_conversions_lock = threading.Lock()
+
+
+def get_conversion_cache():
+    global _conversions
+    if _conversions is None:
+        with _conversions_lock:
+            if _conversions is None:
+                _conversions = ConversionCache()
+    return _conversions
@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import json
+import os
+import signal
+from contextlib import aclosing
+
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse, QueryDict, StreamingHttpResponse
+
+from .aio import stream_async
+
+# Views served by the daemon, undecorated, by name.
+DAEMON_VIEWS = {}
+
+CHUNK_SIZE = 256 * 1024
+
+
+def daemon_view(view):
+    # With STREAM_DAEMON_SOCKET set, web workers hold no torrent state and
+    # forward the request to the daemon, which runs the view itself.
+    DAEMON_VIEWS[view.__name__] = view
+    if not settings.STREAM_DAEMON_SOCKET:
+        return view
+
+    @functools.wraps(view)
+    async def forwarding_view(request):
+        return await forward(request, view.__name__)
+    return forwarding_view
+
+
+class ForwardedRequest(HttpRequest):
+    """A request rebuilt in the daemon from what the web worker received."""
+
+    def __init__(self, message):
+        super().__init__()
+        self.method = message['method']
+        self.path = self.path_info = message['path']
+        self.META = message['meta']
+        self.GET = QueryDict(self.META.get('QUERY_STRING', ''))
+        self.forwarded_scheme = message['scheme']
+
+    def _get_scheme(self):
+        return self.forwarded_scheme
+
+
+async def forward(request, name):
+    try:
+        reader, writer = await asyncio.open_unix_connection(settings.STREAM_DAEMON_SOCKET)
+    except OSError as e:
+        return JsonResponse({'status': 'error', 'message': f'Stream service unavailable: {e}'}, status=503)
+    meta = {key: value for key, value in request.META.items()
+            if key.startswith('HTTP_') or key in ('QUERY_STRING', 'REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT')}
+    message = {'view': name, 'method': request.method, 'path': request.path, 'meta': meta, 'scheme': request.scheme}
+    try:
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+        head = json.loads(await reader.readline() or 'null')
+    except (OSError, ValueError) as e:
+        writer.close()
+        return JsonResponse({'status': 'error', 'message': f'Stream service unavailable: {e}'}, status=503)
+    if head is None:
+        writer.close()
+        return JsonResponse({'status': 'error', 'message': 'Stream service closed the connection'}, status=503)
+    response = StreamingHttpResponse(relay(reader, writer), status=head['status'])
+    for header, value in head['headers']:
+        response[header] = value
+    return response
+
+
+async def relay(reader, writer):
+    # The daemon closes the connection after the body; a short body means it stopped early.
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+    finally:
+        writer.close()
+
+
+class StreamDaemon:
+    """Owns the torrent session and stream registry and serves stream views over a Unix socket."""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = await asyncio.start_unix_server(self.handle, self.path)
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopped.set)
+        print(f"[Daemon] Serving stream requests on {self.path}")
+        try:
+            await stopped.wait()
+        finally:
+            server.close()
+            os.remove(self.path)
+            print("[Daemon] Stopped")
+
+    async def respond(self, message):
+        view = DAEMON_VIEWS.get(message['view'])
+        if view is None:
+            return JsonResponse({'status': 'error', 'message': f"Unknown view {message['view']}"}, status=404)
+        request = ForwardedRequest(message)
+        try:
+            if asyncio.iscoroutinefunction(view):
+                return await view(request)
+            return await asyncio.to_thread(view, request)
+        except Exception as e:
+            print(f"[Daemon] {message['view']} failed: {e}")
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    async def handle(self, reader, writer):
+        response = None
+        try:
+            message = json.loads(await reader.readline())
+            response = await self.respond(message)
+            head = {'status': response.status_code, 'headers': list(response.items())}
+            writer.write(json.dumps(head).encode() + b'\n')
+            if response.streaming:
+                async with aclosing(aiter(stream_async(response))) as content:
+                    async for data in content:
+                        writer.write(data)
+                        await writer.drain()
+            else:
+                writer.write(response.content)
+            await writer.drain()
+        except (ConnectionError, ValueError, KeyError) as e:
+            # The web worker's client went away, or the request was malformed.
+            if not isinstance(e, ConnectionError):
+                print(f"[Daemon] Bad request: {e}")
+        finally:
+            if response is not None:
+                await asyncio.to_thread(response.close)
+            writer.close()
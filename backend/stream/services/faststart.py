@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+
+from .cache import get_disk_cache
+from .container import mp4_moov_at_end
+from .transcode import BACKGROUND, get_transcode_supervisor
+
+
+class FaststartRemuxer:
+    """Remuxes finished MP4 downloads with moov first, a few at a time per host."""
+
+    def __init__(self):
+        self.limit = settings.STREAM_FASTSTART_MAX_JOBS
+        self.pending = deque()
+        self.running = {}
+        self.failed = set()
+        self.finished = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def path_for(movie_path):
+        # Kept with the title's conversions; the original stays in place for the torrent to seed.
+        directory = get_disk_cache().derived_path(movie_path, 'converted')
+        return os.path.join(directory, f"{Path(movie_path).stem}.faststart.mp4")
+
+    def ready_path(self, movie_path):
+        path = self.path_for(movie_path)
+        try:
+            if os.path.getmtime(path) >= os.path.getmtime(movie_path):
+                return path
+        except OSError:
+            pass
+        return None
+
+    def needs_remux(self, movie_path):
+        try:
+            with open(movie_path, 'rb') as f:
+                def read(position, size):
+                    f.seek(position)
+                    return f.read(size)
+                return mp4_moov_at_end(read, os.path.getsize(movie_path))
+        except OSError:
+            return False
+
+    def schedule(self, movie_path):
+        key = os.path.abspath(movie_path)
+        with self.lock:
+            if key in self.running or key in self.pending or key in self.failed:
+                return
+            if self.ready_path(movie_path) or not self.needs_remux(movie_path):
+                return
+            self.pending.append(key)
+            self.dispatch()
+
+    def dispatch(self):
+        while len(self.running) < self.limit and self.pending:
+            self.start(self.pending.popleft())
+
+    def start(self, movie_path):
+        path = self.path_for(movie_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y',
+            '-i', movie_path,
+            '-map', '0', '-c', 'copy',
+            '-movflags', '+faststart',
+            '-f', 'mp4',
+            f"{path}.partial",
+        ]
+        print(f"[Faststart] Remuxing {movie_path}")
+        get_disk_cache().pin(movie_path)
+        job = get_transcode_supervisor().submit(cmd, priority=BACKGROUND, name=f"faststart remux of {movie_path}",
+                                                on_exit=self.on_exit)
+        if job.done():
+            # ffmpeg could not be started at all.
+            self.failed.add(movie_path)
+            self.unpin(movie_path)
+            return
+        self.running[movie_path] = job
+
+    @staticmethod
+    def unpin(movie_path):
+        cache = get_disk_cache()
+        title = cache.title_of(movie_path)
+        if title is not None:
+            cache.unpin(title)
+
+    def on_exit(self, job):
+        with self.lock:
+            movie_path = next((key for key, running in self.running.items() if running is job), None)
+            if movie_path is None:
+                return
+            del self.running[movie_path]
+            self.unpin(movie_path)
+            path = self.path_for(movie_path)
+            if job.returncode == 0:
+                os.replace(f"{path}.partial", path)
+                self.finished += 1
+                print(f"[Faststart] Finished {path}")
+            else:
+                # Not retried: a file ffmpeg cannot copy would fail again.
+                self.failed.add(movie_path)
+                if os.path.exists(f"{path}.partial"):
+                    os.remove(f"{path}.partial")
+            self.dispatch()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'running': list(self.running),
+                'pending': len(self.pending),
+                'finished': self.finished,
+                'failed': len(self.failed),
+            }
+
+
+_remuxer = None
+_remuxer_lock = threading.Lock()
+
+
+def get_faststart_remuxer():
+    global _remuxer
+    if _remuxer is None:
+        with _remuxer_lock:
+            if _remuxer is None:
+                _remuxer = FaststartRemuxer()
+    return _remuxer
@@ -0,0 +1,262 @@
+import asyncio
+import atexit
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from .aio import Signal
+from .cache import get_disk_cache
+from .media import get_media_store
+from .transcode import get_transcode_supervisor
+
+
+class HlsTranscoder:
+    """One long-running ffmpeg writing fixed-length HLS segments of a title to disk."""
+
+    def __init__(self, movie_path, source, duration):
+        self.movie_path = movie_path
+        self.source = source
+        self.duration = duration
+        self.segment_seconds = settings.STREAM_HLS_SEGMENT_SECONDS
+        self.directory = get_disk_cache().derived_path(movie_path, 'hls', Path(movie_path).stem)
+        # Segments are written while the transcoder is cached; the title must not be evicted meanwhile.
+        self.cache_title = get_disk_cache().pin(movie_path)
+        self.job = None
+        self.start_segment = None
+        self.next_segment = None
+        self.restarts = 0
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+        # Requests waiting for a segment, by segment number.
+        self.waiters = {}
+        self.waiters_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def segment_count(self):
+        # A tail shorter than a tenth of a segment is folded into the last one, as ffmpeg does.
+        return max(math.ceil(self.duration / self.segment_seconds - 0.1), 1)
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"segment_{number:05d}.ts")
+
+    def playlist(self, segment_url):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{self.segment_seconds}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for number in range(self.segment_count()):
+            length = self.segment_seconds
+            if number == self.segment_count() - 1:
+                length = self.duration - number * self.segment_seconds
+            lines.append(f'#EXTINF:{length:.3f},')
+            lines.append(segment_url(number))
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def running(self):
+        return self.job is not None and not self.job.done()
+
+    def encoder_position(self):
+        # First segment at or after the encoder's start that is not on disk yet.
+        while self.next_segment < self.segment_count() and os.path.exists(self.segment_path(self.next_segment)):
+            self.next_segment += 1
+        return self.next_segment
+
+    def start(self, number):
+        self.stop()
+        offset = number * self.segment_seconds
+        cmd = [
+            # Info level for the muxer's "Opening" lines, which mark finished segments.
+            'ffmpeg', '-v', 'level+info', '-nostats', '-hide_banner', '-nostdin',
+            '-ss', str(offset),
+        ]
+        if self.source.startswith(('http://', 'https://')):
+            # The stream endpoint caps each response; without reconnecting ffmpeg would take
+            # the end of the first one for the end of the input.
+            cmd += ['-reconnect', '1']
+        cmd += [
+            '-i', self.source,
+            '-map', '0:v:0', '-map', '0:a:0?',
+            '-c:v', 'libx264', '-preset', 'veryfast',
+            '-c:a', 'aac', '-ac', '2',
+            # Keyframes on every segment boundary keep segments exactly segment_seconds long.
+            '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_seconds})',
+            '-output_ts_offset', str(offset),
+            '-f', 'hls',
+            '-hls_time', str(self.segment_seconds),
+            '-hls_list_size', '0',
+            '-hls_flags', 'temp_file',
+            '-start_number', str(number),
+            '-hls_segment_filename', os.path.join(self.directory, 'segment_%05d.ts'),
+            os.path.join(self.directory, 'encoder.m3u8'),
+        ]
+        print(f"[HLS] Starting encoder for {self.movie_path} at segment {number}")
+        self.job = get_transcode_supervisor().submit(cmd, name=f"HLS encoder for {self.movie_path}",
+                                                     on_exit=self.on_exit, on_output=self.on_output)
+        self.start_segment = number
+        self.next_segment = number
+        self.restarts += 1
+
+    def stop(self):
+        # Cleared first, so waiters woken by the exit see a restart rather than a failed encoder.
+        job, self.job = self.job, None
+        if job is not None and not job.done():
+            # Killed rather than terminated: on SIGTERM ffmpeg would finish the
+            # segment in progress early and leave a short segment in the cache.
+            job.stop()
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def on_output(self, line):
+        # With temp_file, a segment is renamed into place before the next file is opened.
+        if "Opening '" in line:
+            self.notify()
+        return '[info]' in line
+
+    def on_exit(self, job):
+        # An encoder that was not stopped and did not reach the last segment lost its input;
+        # the segment it was writing was renamed into place cut short.
+        if job is self.job and not os.path.exists(self.segment_path(self.segment_count() - 1)):
+            last = self.encoder_position() - 1
+            if last >= self.start_segment:
+                print(f"[HLS] Encoder for {self.movie_path} ended early, dropping segment {last}")
+                try:
+                    os.remove(self.segment_path(last))
+                except OSError:
+                    pass
+                self.next_segment = last
+        self.notify(everyone=True)
+
+    def notify(self, everyone=False):
+        with self.waiters_lock:
+            ready = [number for number in self.waiters
+                     if everyone or os.path.exists(self.segment_path(number))]
+            signals = [self.waiters.pop(number) for number in ready]
+        for signal in signals:
+            signal.set()
+
+    def waiter(self, number):
+        with self.waiters_lock:
+            return self.waiters.setdefault(number, Signal())
+
+    def request(self, number):
+        # Path of the segment; starts the encoder where it will not reach the segment soon.
+        if not 0 <= number < self.segment_count():
+            raise ValueError(f"Segment {number} does not exist")
+        self.last_access = time.monotonic()
+        path = self.segment_path(number)
+        if os.path.exists(path):
+            return path
+        with self.lock:
+            # Restart when the request is behind the encoder or too far ahead of it to wait for.
+            if (not self.running() or number < self.start_segment
+                    or number > self.encoder_position() + settings.STREAM_HLS_MAX_AHEAD):
+                self.start(number)
+        return path
+
+    async def segment(self, number, timeout):
+        # Waits as a coroutine until the encoder's output or exit signals the segment.
+        path = await asyncio.to_thread(self.request, number)
+        deadline = time.monotonic() + timeout
+        while True:
+            # Registered before checking, so a segment finished in between is not missed.
+            signal = self.waiter(number)
+            if os.path.exists(path):
+                break
+            job = self.job
+            if job is not None and job.done():
+                raise IOError(f"Encoder for {self.movie_path} stopped before segment {number}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not await signal.wait_async(remaining):
+                raise TimeoutError(f"Timed out after {timeout}s waiting for segment {number}")
+        self.last_access = time.monotonic()
+        return path
+
+    def close(self):
+        self.stop()
+        if self.cache_title is not None:
+            get_disk_cache().unpin(self.cache_title)
+            self.cache_title = None
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_access
+
+    def stats(self):
+        return {
+            'movie_path': self.movie_path,
+            'running': self.running(),
+            'start_segment': self.start_segment,
+            'encoder_position': self.encoder_position() if self.start_segment is not None else None,
+            'segments': self.segment_count(),
+            'restarts': self.restarts,
+            'idle_seconds': round(self.idle_seconds()),
+        }
+
+
+class HlsCache:
+    """HLS transcoders by title; idle encoders are stopped, their segments stay cached."""
+
+    def __init__(self):
+        self.transcoders = {}
+        self.lock = threading.Lock()
+
+    def transcoder(self, movie_path, source):
+        key = os.path.abspath(movie_path)
+        with self.lock:
+            transcoder = self.transcoders.get(key)
+            if transcoder is not None:
+                # A torrent read through the stream endpoint switches to the file once complete.
+                transcoder.source = source
+                return transcoder
+        # The source is the stream endpoint only while the torrent is still downloading.
+        info = get_media_store().get(movie_path, timeout=settings.STREAM_PROBE_WAIT, partial=source != movie_path)
+        if not info or not info['duration']:
+            raise IOError(f"No duration known for {movie_path} yet")
+        with self.lock:
+            transcoder = self.transcoders.get(key)
+            if transcoder is None:
+                transcoder = self.transcoders[key] = HlsTranscoder(movie_path, source, info['duration'])
+            return transcoder
+
+    def reap(self):
+        with self.lock:
+            items = list(self.transcoders.items())
+        for key, transcoder in items:
+            if transcoder.idle_seconds() >= settings.STREAM_HLS_IDLE_SECONDS:
+                if transcoder.running():
+                    print(f"[HLS] Stopping idle encoder for {transcoder.movie_path}")
+                transcoder.close()
+                with self.lock:
+                    self.transcoders.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return [transcoder.stats() for transcoder in self.transcoders.values()]
+
+    def shutdown(self):
+        with self.lock:
+            transcoders = list(self.transcoders.values())
+        for transcoder in transcoders:
+            transcoder.stop()
+
+
+_hls = None
+_hls_lock = threading.Lock()
+
+
+def get_hls_cache():
+    global _hls
+    if _hls is None:
+        with _hls_lock:
+            if _hls is None:
+                _hls = HlsCache()
+                atexit.register(_hls.shutdown)
+    return _hls
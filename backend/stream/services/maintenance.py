@@ -0,0 +1,133 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .cache import get_disk_cache
+from .conversions import get_conversion_cache
+from .hls import get_hls_cache
+from .registry import get_stream_registry
+from .session import get_session_manager
+
+
+class MaintenanceJob:
+
+    def __init__(self, name, func, interval, jitter):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.next_run = time.monotonic() + self.delay()
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.last_error = None
+
+    def delay(self):
+        # Jitter keeps jobs with equal intervals from always firing together.
+        return max(self.interval * (1 + random.uniform(-self.jitter, self.jitter)), 1)
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            self.func()
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"[Maintenance] {self.name} failed: {e}")
+        finally:
+            self.last_duration = time.monotonic() - started
+            self.total_duration += self.last_duration
+            self.runs += 1
+            self.next_run = time.monotonic() + self.delay()
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_duration_ms': round(self.last_duration * 1000) if self.last_duration is not None else None,
+            'avg_duration_ms': round(self.total_duration / self.runs * 1000) if self.runs else None,
+            'next_run_in': round(max(self.next_run - time.monotonic(), 0)),
+            'last_error': self.last_error,
+        }
+
+
+class MaintenanceScheduler:
+    """Runs the periodic stream maintenance jobs from a single thread."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name='stream-maintenance', daemon=True)
+
+    def add_job(self, name, func, interval, jitter=None):
+        jitter = settings.STREAM_MAINTENANCE_JITTER if jitter is None else jitter
+        with self.condition:
+            self.jobs[name] = MaintenanceJob(name, func, interval, jitter)
+            self.condition.notify()
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                job = min(self.jobs.values(), key=lambda job: job.next_run, default=None)
+                wait = job.next_run - time.monotonic() if job else None
+                if wait is None or wait > 0:
+                    self.condition.wait(wait)
+                    continue
+            job.run()
+
+    def stats(self):
+        with self.condition:
+            return {name: job.stats() for name, job in self.jobs.items()}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = MaintenanceScheduler()
+    return _scheduler
+
+
+def log_stats():
+    torrents = get_session_manager().status()
+    download_rate = sum(torrent['download_rate'] for torrent in torrents)
+    upload_rate = sum(torrent['upload_rate'] for torrent in torrents)
+    cache = get_disk_cache().stats()
+    print(f"[Stats] {len(torrents)} torrent(s), down {download_rate // 1024} KiB/s, up {upload_rate // 1024} KiB/s, "
+          f"disk {cache['size'] // 1024 ** 2}/{cache['budget'] // 1024 ** 2} MiB, {cache['evictions']} eviction(s)")
+
+
+def start_maintenance():
+    registry = get_stream_registry()
+    scheduler = get_scheduler()
+    scheduler.add_job('resume-flush', registry.flush, settings.STREAM_RESUME_SAVE_INTERVAL)
+    scheduler.add_job('idle-reaper', registry.reap, settings.STREAM_REAP_INTERVAL)
+    scheduler.add_job('disk-cache', get_disk_cache().maintain, settings.STREAM_DISK_CACHE_INTERVAL)
+    scheduler.add_job('hls-reaper', get_hls_cache().reap, settings.STREAM_HLS_IDLE_SECONDS / 2)
+    scheduler.add_job('conversion-reaper', get_conversion_cache().reap, settings.STREAM_CONVERSION_IDLE_SECONDS / 2)
+    scheduler.add_job('stats', log_stats, settings.STREAM_STATS_INTERVAL)
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,332 @@
+import atexit
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+def parse_rate(rate):
+    try:
+        numerator, denominator = rate.split('/')
+        return round(int(numerator) / int(denominator), 3) if int(denominator) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def probe_media(path):
+    cmd = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', path]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=settings.STREAM_PROBE_TIMEOUT)
+    if result.returncode != 0:
+        raise IOError(f"ffprobe failed for {path}: {result.stderr.strip()}")
+    data = json.loads(result.stdout)
+    media_format = data.get('format', {})
+    info = {
+        'duration': to_float(media_format.get('duration')),
+        'container': media_format.get('format_name'),
+        'bit_rate': to_int(media_format.get('bit_rate')),
+        'video': [],
+        'audio': [],
+        'subtitles': [],
+        'keyframe_interval': None,
+    }
+    for stream in data.get('streams', []):
+        codec_type = stream.get('codec_type')
+        language = stream.get('tags', {}).get('language')
+        if codec_type == 'video' and not stream.get('disposition', {}).get('attached_pic'):
+            info['video'].append({
+                'index': stream['index'],
+                'codec': stream.get('codec_name'),
+                'profile': stream.get('profile'),
+                'pix_fmt': stream.get('pix_fmt'),
+                'width': stream.get('width'),
+                'height': stream.get('height'),
+                'fps': parse_rate(stream.get('avg_frame_rate')),
+                'bit_rate': to_int(stream.get('bit_rate')),
+            })
+        elif codec_type == 'audio':
+            info['audio'].append({
+                'index': stream['index'],
+                'codec': stream.get('codec_name'),
+                'channels': stream.get('channels'),
+                'sample_rate': to_int(stream.get('sample_rate')),
+                'bit_rate': to_int(stream.get('bit_rate')),
+                'language': language,
+            })
+        elif codec_type == 'subtitle':
+            info['subtitles'].append({
+                'index': stream['index'],
+                'codec': stream.get('codec_name'),
+                'language': language,
+            })
+    if info['video']:
+        info['keyframe_interval'] = probe_keyframe_interval(path)
+    return info
+
+
+def probe_keyframe_interval(path, seconds=120):
+    # Packet flags are enough to spot keyframes, nothing has to be decoded.
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', f'%+{seconds}',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=settings.STREAM_PROBE_TIMEOUT)
+    times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and to_float(pts_time) is not None:
+            times.append(float(pts_time))
+    times.sort()
+    if len(times) < 2:
+        return None
+    return round((times[-1] - times[0]) / (len(times) - 1), 3)
+
+
+class SeekIndex:
+    """Keyframe times and byte positions of the first video stream, both ascending."""
+
+    MAGIC = b'SEEKIDX1'
+
+    def __init__(self, times=None, positions=None):
+        self.times = times if times is not None else array('d')
+        self.positions = positions if positions is not None else array('q')
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, time, position):
+        # Keeps both columns ascending: positions are bisected, and times stay in keyframe order.
+        if self.times and (time <= self.times[-1] or position <= self.positions[-1]):
+            return
+        self.times.append(time)
+        self.positions.append(position)
+
+    def time_at(self, position):
+        # Time of the last keyframe starting at or before a byte position.
+        index = bisect_right(self.positions, position) - 1
+        return self.times[index] if index >= 0 else 0.0
+
+    def dump(self, path):
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(len(self).to_bytes(8, 'little'))
+            self.times.tofile(f)
+            self.positions.tofile(f)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"{path} is not a seek index")
+            count = int.from_bytes(f.read(8), 'little')
+            index.times.fromfile(f, count)
+            index.positions.fromfile(f, count)
+        return index
+
+
+def build_seek_index(path):
+    # Scans packet headers only, so this reads the file once without decoding it.
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,pos,flags', '-of', 'csv=p=0', path]
+    index = SeekIndex()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    timer = threading.Timer(settings.STREAM_SEEK_INDEX_TIMEOUT, process.kill)
+    timer.start()
+    try:
+        for line in process.stdout:
+            fields = line.strip().split(',')
+            if len(fields) < 3 or 'K' not in fields[2]:
+                continue
+            pts_time, position = to_float(fields[0]), to_int(fields[1])
+            if pts_time is not None and position is not None:
+                index.add(pts_time, position)
+        if process.wait() != 0:
+            raise IOError(f"ffprobe failed to index {path}")
+    finally:
+        timer.cancel()
+    return index
+
+
+class MediaInfoStore:
+    """ffprobe results keyed by path, size and mtime, probed once in the background."""
+
+    def __init__(self):
+        self.path = os.path.join(settings.STREAM_STATE_DIR, 'media_info.json')
+        self.index_dir = os.path.join(settings.STREAM_STATE_DIR, 'seek_index')
+        self.entries = {}
+        self.indexes = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        # Probe workers and the indexer all write the same temporary file.
+        self.save_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=settings.STREAM_PROBE_WORKERS, thread_name_prefix='media-probe')
+        os.makedirs(self.index_dir, exist_ok=True)
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(path):
+        return os.path.abspath(path)
+
+    def entry(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(self.key(path))
+        if entry is None or entry['size'] != stat.st_size:
+            return None
+        # Files still being downloaded change mtime with every piece; their
+        # entry stays valid until the file completes and is probed again.
+        if not entry.get('partial') and entry['mtime'] != stat.st_mtime:
+            return None
+        return entry
+
+    def lookup(self, path):
+        entry = self.entry(path)
+        return entry['info'] if entry else None
+
+    def index_path(self, key):
+        return os.path.join(self.index_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.idx")
+
+    def seek_index(self, path):
+        if self.lookup(path) is None:
+            return None
+        key = self.key(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not entry.get('seek_index'):
+                return None
+            index = self.indexes.get(key)
+        if index is None:
+            try:
+                index = SeekIndex.load(self.index_path(key))
+            except (OSError, ValueError, EOFError) as e:
+                print(f"[MediaInfo] Could not load seek index for {path}: {e}")
+                return None
+            with self.lock:
+                self.indexes[key] = index
+        return index
+
+    def get(self, path, timeout=None, partial=False):
+        # partial: the file is still being downloaded, see entry().
+        entry = self.entry(path)
+        if entry is not None:
+            # Failed probes are remembered too, so unreadable files are not probed over and over.
+            return entry['info']
+        future = self.schedule(path, partial)
+        if timeout:
+            try:
+                return future.result(timeout)
+            except Exception as e:
+                print(f"[MediaInfo] No media info for {path} yet: {e}")
+        return None
+
+    def schedule(self, path, partial=False):
+        key = self.key(path)
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = self.executor.submit(self.probe, path, partial)
+        return future
+
+    def probe(self, path, partial=False):
+        key = self.key(path)
+        stat = None
+        try:
+            stat = os.stat(path)
+            info = probe_media(path)
+            with self.lock:
+                self.entries[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'partial': partial,
+                                     'seek_index': 0, 'info': info}
+                self.indexes.pop(key, None)
+            self.save()
+            print(f"[MediaInfo] Probed {path}: {info['container']}, {info['duration']}s")
+            if info['video'] and not partial:
+                # Missing pieces would put holes in the index; wait for the whole file.
+                self.executor.submit(self.build_index, path, stat)
+            return info
+        except Exception as e:
+            print(f"[MediaInfo] Probe failed for {path}: {e}")
+            if stat is not None:
+                with self.lock:
+                    self.entries[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'partial': partial,
+                                         'seek_index': 0, 'info': None, 'error': str(e)}
+                self.save()
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def build_index(self, path, stat):
+        # Runs after the probe so callers waiting for media info are not held up by the full scan.
+        key = self.key(path)
+        try:
+            index = build_seek_index(path)
+            index.dump(self.index_path(key))
+        except Exception as e:
+            print(f"[MediaInfo] Seek index failed for {path}: {e}")
+            return
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                return
+            entry['seek_index'] = len(index)
+            self.indexes[key] = index
+        self.save()
+        print(f"[MediaInfo] Indexed {len(index)} keyframe(s) of {path}")
+
+    def forget(self, path):
+        key = self.key(path)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.indexes.pop(key, None)
+        try:
+            os.remove(self.index_path(key))
+        except OSError:
+            pass
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps(self.entries)
+            with open(f"{self.path}.tmp", 'w') as f:
+                f.write(data)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_media_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaInfoStore()
+                atexit.register(_store.save)
+    return _store
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+
+import libtorrent as lt
+from django.conf import settings
+
+from .alerts import handle_key
+
+
+class MetadataStore:
+    """Bencoded info dicts by info hash, from .torrent downloads and metadata fetched from peers."""
+
+    def __init__(self):
+        self.directory = os.path.join(settings.STREAM_STATE_DIR, 'metadata')
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        # Trackers by info hash and info hashes by .torrent URL; the info dict itself has neither.
+        self.index = {'trackers': {}, 'urls': {}}
+        try:
+            with open(self.index_path) as f:
+                self.index.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"[Metadata] Could not read {self.index_path}: {e}")
+
+    def info_path(self, key):
+        return os.path.join(self.directory, f"{key}.info")
+
+    def save(self, torrent_info, url=None):
+        info = torrent_info.info_section()
+        if not info:
+            return
+        # torrent_info has the same info_hashes() as a handle, so keys match the session's.
+        key = handle_key(torrent_info)
+        path = self.info_path(key)
+        with self.lock:
+            if not os.path.exists(path):
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(info)
+                os.replace(f"{path}.tmp", path)
+                print(f"[Metadata] Stored metadata for {key}")
+            trackers = self.index['trackers'].setdefault(key, [])
+            for tracker in torrent_info.trackers():
+                if [tracker.url, tracker.tier] not in trackers:
+                    trackers.append([tracker.url, tracker.tier])
+            if url:
+                self.index['urls'][url] = key
+            self.save_index()
+
+    def save_index(self):
+        with open(f"{self.index_path}.tmp", 'w') as f:
+            json.dump(self.index, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+
+    def load(self, key):
+        try:
+            with open(self.info_path(key), 'rb') as f:
+                info = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            torrent_info = lt.torrent_info(b'd4:info' + info + b'e')
+        except RuntimeError as e:
+            print(f"[Metadata] Ignoring unreadable metadata for {key}: {e}")
+            return None
+        # Content-addressed: a file that does not hash to its name is not trusted.
+        if handle_key(torrent_info) != key:
+            print(f"[Metadata] Ignoring metadata for {key}: info hash mismatch")
+            return None
+        with self.lock:
+            trackers = list(self.index['trackers'].get(key, []))
+        for url, tier in trackers:
+            torrent_info.add_tracker(url, tier)
+        return torrent_info
+
+    def for_url(self, url):
+        with self.lock:
+            key = self.index['urls'].get(url)
+        return self.load(key) if key else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_metadata_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetadataStore()
+    return _store
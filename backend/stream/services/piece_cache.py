@@ -0,0 +1,56 @@
+import threading
+from collections import Counter, OrderedDict
+
+
+class PieceCache:
+    """Recently read pieces by (info hash, piece), least recently used evicted past a byte budget."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.pieces = OrderedDict()
+        self.size = 0
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        # A memoryview, so responses slice the piece without copying it.
+        with self.lock:
+            piece = self.pieces.get(key)
+            if piece is None:
+                self.counters['misses'] += 1
+                return None
+            self.pieces.move_to_end(key)
+            self.counters['hits'] += 1
+            return memoryview(piece)
+
+    def put(self, key, piece):
+        if len(piece) > self.budget:
+            return
+        with self.lock:
+            previous = self.pieces.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.pieces[key] = piece
+            self.size += len(piece)
+            while self.size > self.budget:
+                _, evicted = self.pieces.popitem(last=False)
+                self.size -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def forget(self, info_hash):
+        with self.lock:
+            for key in [key for key in self.pieces if key[0] == info_hash]:
+                self.size -= len(self.pieces.pop(key))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                'pieces': len(self.pieces),
+                'size': self.size,
+                'budget': self.budget,
+                'hits': self.counters['hits'],
+                'misses': self.counters['misses'],
+                'evictions': self.counters['evictions'],
+                'hit_ratio': round(self.counters['hits'] / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,148 @@
+import math
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+TOP_PRIORITY = 7
+DEFAULT_PRIORITY = 4
+
+
+class PlaybackWindow:
+    """Deadline window of pieces ahead of one reader's position."""
+
+    def __init__(self):
+        self.head = None
+        self.pieces = []
+        self.seek_started_at = None
+
+    def end(self):
+        return self.pieces[-1] if self.pieces else self.head
+
+    def covers(self, piece_index):
+        # The piece right after the window continues it rather than seeking.
+        return self.head is not None and self.head <= piece_index <= self.end() + 1
+
+
+class PiecePrioritizer:
+    """Keeps a deadline window of pieces ahead of each reader's playback position."""
+
+    def __init__(self, handle, torrent_info, first_piece=0, last_piece=None):
+        self.handle = handle
+        self.piece_length = torrent_info.piece_length()
+        self.first_piece = first_piece
+        self.last_piece = torrent_info.num_pieces() - 1 if last_piece is None else last_piece
+        self.min_window = settings.STREAM_PIECE_WINDOW
+        self.max_window = max(settings.STREAM_PIECE_WINDOW_MAX, self.min_window)
+        # Windows of open readers, and of finished ones the next sequential request may continue.
+        self.windows = {}
+        self.released = []
+        self.ttfb_samples = deque(maxlen=50)
+        self.pinned = set()
+        self.lock = threading.Lock()
+
+    def window_size(self):
+        rate = self.handle.status().download_rate
+        wanted = math.ceil(rate * settings.STREAM_LOOKAHEAD_SECONDS / self.piece_length)
+        return min(max(wanted, self.min_window), self.max_window)
+
+    def on_request(self, piece_index, reader=None):
+        with self.lock:
+            window = self.windows.get(reader)
+            if window is None:
+                window = self.windows[reader] = self.adopt(piece_index)
+            elif not window.covers(piece_index):
+                self.reset_window(window)
+                window.seek_started_at = time.monotonic()
+                print(f"[Prioritizer] Seek to piece {piece_index}")
+            window.head = piece_index if window.head is None else max(piece_index, window.head)
+            last = min(window.head + self.window_size() - 1, self.last_piece)
+            window.pieces = list(range(window.head, last + 1))
+            for offset, piece in enumerate(window.pieces):
+                if self.handle.have_piece(piece):
+                    continue
+                self.handle.piece_priority(piece, TOP_PRIORITY)
+                self.handle.set_piece_deadline(
+                    piece, settings.STREAM_DEADLINE_MS + offset * settings.STREAM_DEADLINE_STEP_MS)
+
+    def adopt(self, piece_index):
+        # A request continuing a finished reader's window takes it over; one that lands in
+        # another open window shares its pieces. Anything else is a seek, and nobody is
+        # left to continue the finished windows.
+        for window in self.released:
+            if window.covers(piece_index):
+                self.released.remove(window)
+                return window
+        window = PlaybackWindow()
+        if any(other.covers(piece_index) for other in self.windows.values()):
+            return window
+        released, self.released = self.released, []
+        for finished in released:
+            self.reset_window(finished)
+        window.seek_started_at = time.monotonic()
+        print(f"[Prioritizer] Seek to piece {piece_index}")
+        return window
+
+    def release(self, reader):
+        with self.lock:
+            window = self.windows.pop(reader, None)
+            if window is not None and window.head is not None:
+                self.released.append(window)
+
+    def reset_window(self, window):
+        # Piece by piece: the handle may be shared with streams of other files in the torrent,
+        # and pieces still in another reader's window keep their deadlines.
+        others = set()
+        for other in [*self.windows.values(), *self.released]:
+            if other is not window:
+                others.update(other.pieces)
+        for piece in window.pieces:
+            if piece not in self.pinned and piece not in others:
+                self.handle.reset_piece_deadline(piece)
+                self.handle.piece_priority(piece, DEFAULT_PRIORITY)
+        window.pieces = []
+        window.head = None
+
+    def pin(self, pieces):
+        # Container headers and indexes: top priority and the first deadline until they are
+        # downloaded, whatever the playback position does in the meantime.
+        with self.lock:
+            self.pinned.update(pieces)
+            self.apply_pins()
+
+    def apply_pins(self):
+        for piece in sorted(self.pinned):
+            if self.handle.have_piece(piece):
+                self.pinned.discard(piece)
+                continue
+            self.handle.piece_priority(piece, TOP_PRIORITY)
+            self.handle.set_piece_deadline(piece, settings.STREAM_DEADLINE_MS)
+
+    def on_first_byte(self, reader=None):
+        with self.lock:
+            window = self.windows.get(reader)
+            if window is None or window.seek_started_at is None:
+                return
+            ttfb = time.monotonic() - window.seek_started_at
+            window.seek_started_at = None
+            self.ttfb_samples.append(ttfb)
+        print(f"[Prioritizer] Time to first byte after seek: {ttfb * 1000:.0f} ms")
+
+    def metrics(self):
+        with self.lock:
+            samples = list(self.ttfb_samples)
+            heads = [window.head for window in self.windows.values() if window.head is not None]
+            pieces = set()
+            for window in [*self.windows.values(), *self.released]:
+                pieces.update(window.pieces)
+            return {
+                'readers': len(self.windows),
+                'head_piece': max(heads) if heads else None,
+                'window_size': len(pieces),
+                'window_end': max(pieces) if pieces else None,
+                'pinned_pieces': len(self.pinned),
+                'seek_count': len(samples),
+                'last_seek_ttfb_ms': round(samples[-1] * 1000) if samples else None,
+                'avg_seek_ttfb_ms': round(sum(samples) / len(samples) * 1000) if samples else None,
+            }
@@ -0,0 +1,167 @@
+import atexit
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import libtorrent as lt
+from django.conf import settings
+
+from .cache import get_disk_cache
+from .faststart import get_faststart_remuxer
+from .media import get_media_store
+from .session import get_session_manager
+from .stream import DIRECT, TorrentStream, VideoConverter
+
+
+class StreamRegistry:
+    """Active streams by stream id, persisted so they survive a restart."""
+
+    def __init__(self):
+        self.path = os.path.join(settings.STREAM_STATE_DIR, 'streams.json')
+        self.streams = {}
+        self.lock = threading.RLock()
+        self.manager = get_session_manager()
+        self.executor = ThreadPoolExecutor(max_workers=settings.STREAM_INIT_WORKERS, thread_name_prefix='stream-init')
+        self.manager.alerts.subscribe(lt.file_completed_alert, self.on_file_completed)
+
+    def get(self, stream_id):
+        return self.streams.get(stream_id)
+
+    def start(self, stream_id, source, file_index=None):
+        # Get or create, so concurrent inits of one id share a stream instead of orphaning one.
+        # Returns the stream and whether it was created; a failed stream is replaced.
+        with self.lock:
+            existing = self.streams.get(stream_id)
+            if existing is not None and existing.state != 'failed':
+                return existing, False
+            if existing is not None:
+                self.remove(stream_id)
+            self.evict(settings.STREAM_MAX_ACTIVE - 1)
+            ts = TorrentStream(file_index)
+            ts.source = source
+            self.streams[stream_id] = ts
+        self.executor.submit(ts.start, **source)
+        self.save()
+        return ts, True
+
+    def on_file_completed(self, alert):
+        # Partial probes are replaced once the whole file is on disk.
+        files = alert.handle.torrent_file().files()
+        path = os.path.join(alert.handle.status().save_path, files.file_path(alert.index))
+        cache = get_disk_cache()
+        title = cache.title_of(path)
+        if title is not None:
+            cache.refresh(title)
+        if VideoConverter.is_video(path):
+            probe = get_media_store().schedule(path)
+            # The plan needs the fresh probe, which must not be waited for on the alert thread.
+            probe.add_done_callback(lambda _: self.schedule_faststart(path))
+
+    @staticmethod
+    def schedule_faststart(path):
+        # Only files served as they are use the faststart copy; conversions write their own MP4.
+        if VideoConverter.plan(path, wait=False) == DIRECT:
+            get_faststart_remuxer().schedule(path)
+
+    def remove(self, stream_id):
+        with self.lock:
+            ts = self.streams.pop(stream_id, None)
+        if ts is not None:
+            ts.remove_stream()
+            self.save()
+        return ts
+
+    def evict(self, limit):
+        # Least recently read streams go first.
+        with self.lock:
+            excess = len(self.streams) - max(limit, 0)
+            if excess <= 0:
+                return
+            victims = sorted(self.streams, key=lambda stream_id: self.streams[stream_id].last_read)[:excess]
+        for stream_id in victims:
+            print(f"[Registry] Evicting least recently used stream {stream_id}")
+            self.remove(stream_id)
+
+    def reap(self):
+        with self.lock:
+            items = list(self.streams.items())
+        idle_by_torrent = {}
+        for stream_id, ts in items:
+            if ts.idle_seconds() >= settings.STREAM_IDLE_REMOVE_SECONDS:
+                print(f"[Registry] Removing stream {stream_id} after {ts.idle_seconds():.0f}s idle")
+                self.remove(stream_id)
+                continue
+            key = ts.info_hash()
+            if key is not None:
+                idle_by_torrent.setdefault(key, []).append(ts)
+        # Streams of different files can share a handle; pause it only when all of them are idle.
+        for streams in idle_by_torrent.values():
+            if all(ts.idle_seconds() >= settings.STREAM_IDLE_PAUSE_SECONDS for ts in streams):
+                for ts in streams:
+                    ts.pause()
+        self.evict(settings.STREAM_MAX_ACTIVE)
+
+    def records(self):
+        with self.lock:
+            items = list(self.streams.items())
+        return {
+            stream_id: {
+                'source': ts.source,
+                'file_index': ts.file_index,
+                'info_hash': ts.info_hash(),
+            }
+            for stream_id, ts in items if ts.state != 'failed'
+        }
+
+    def save(self):
+        records = self.records()
+        with self.lock:
+            with open(f"{self.path}.tmp", 'w') as f:
+                json.dump(records, f)
+            os.replace(f"{self.path}.tmp", self.path)
+
+    def restore(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Registry] Could not read {self.path}: {e}")
+            return
+        for stream_id, record in records.items():
+            if stream_id in self.streams:
+                continue
+            source = record['source']
+            info_hash = record.get('info_hash')
+            if info_hash and self.manager.load_resume_data(info_hash) is not None:
+                # The resume data carries the info dict, so there is nothing to fetch.
+                source = {'magnet_link': f"magnet:?xt=urn:btih:{info_hash}"}
+            ts, _ = self.start(stream_id, source, record.get('file_index'))
+            ts.source = record['source']
+        print(f"[Registry] Restored {len(records)} stream(s)")
+
+    def flush(self):
+        self.manager.save_resume_data()
+        self.save()
+
+    def shutdown(self):
+        try:
+            self.save()
+        except OSError as e:
+            print(f"[Registry] Could not save registry: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_stream_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = StreamRegistry()
+                atexit.register(_registry.shutdown)
+    return _registry
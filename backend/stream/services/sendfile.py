@@ -0,0 +1,72 @@
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+
+class RangedFileReader:
+    """File object limited to one byte range, for wsgi.file_wrapper / sendfile responses."""
+
+    def __init__(self, path, start, length, on_close=None):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+        self.on_close = on_close
+        if hasattr(os, 'posix_fadvise'):
+            # Video is read front to back: ask for aggressive readahead over the range.
+            fd = self.file.fileno()
+            os.posix_fadvise(fd, start, length, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, start, min(length, settings.STREAM_SENDFILE_READAHEAD), os.POSIX_FADV_WILLNEED)
+
+    def fileno(self):
+        # Servers that sendfile() start at the current offset and send Content-Length bytes.
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        # Used when the server copies through Python; never reads past the range.
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            if self.on_close is not None:
+                self.on_close()
+
+
+def offload_path(path):
+    # URL of a file under STREAM_SENDFILE_ROOT for the front proxy, or None if it lies outside.
+    root = os.path.abspath(settings.STREAM_SENDFILE_ROOT)
+    relative = os.path.relpath(os.path.abspath(path), root)
+    if relative.startswith('..'):
+        return None
+    return settings.STREAM_SENDFILE_PREFIX.rstrip('/') + '/' + quote(relative)
+
+
+def offload_response(path, content_type):
+    # The proxy serves the file and applies the client's Range header itself.
+    mode = settings.STREAM_SENDFILE_MODE
+    if mode == 'x-accel':
+        location = offload_path(path)
+        if location is None:
+            return None
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = location
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = os.path.abspath(path)
+        return response
+    return None
+
+
+def ranged_file_response(path, start, end, content_type, status, on_close=None):
+    response = FileResponse(RangedFileReader(path, start, end - start + 1, on_close),
+                            content_type=content_type, status=status)
+    response.block_size = settings.STREAM_SENDFILE_READAHEAD
+    return response
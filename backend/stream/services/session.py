@@ -0,0 +1,236 @@
+import atexit
+import os
+import threading
+from collections import Counter
+
+import libtorrent as lt
+from django.conf import settings
+
+from .alerts import AlertDispatcher, handle_key
+from .metadata import get_metadata_store
+
+
+class SessionManager:
+    """Owns the single libtorrent session shared by every stream in the process."""
+
+    def __init__(self):
+        self.session = lt.session(self.build_settings())
+        self.handles = {}
+        self.lock = threading.Lock()
+        self.resume_dir = os.path.join(settings.STREAM_STATE_DIR, 'resume')
+        os.makedirs(self.resume_dir, exist_ok=True)
+        self.pending_resume = 0
+        self.resume_condition = threading.Condition()
+        self.alerts = AlertDispatcher(self.session)
+        self.alerts.subscribe(lt.save_resume_data_alert, self.on_resume_data)
+        self.alerts.subscribe(lt.save_resume_data_failed_alert, self.on_resume_data_failed)
+        self.alerts.subscribe(lt.metadata_received_alert, self.on_metadata_received)
+        self.alerts.start()
+        print(f"[Session] libtorrent session listening on {settings.TORRENT_LISTEN_INTERFACES}")
+
+    @staticmethod
+    def build_settings():
+        return {
+            'listen_interfaces': settings.TORRENT_LISTEN_INTERFACES,
+            'enable_dht': True,
+            'enable_lsd': True,
+            'enable_upnp': False,
+            'enable_natpmp': False,
+            'dht_bootstrap_nodes': settings.TORRENT_DHT_BOOTSTRAP_NODES,
+            'connections_limit': settings.TORRENT_CONNECTIONS_LIMIT,
+            'active_downloads': settings.TORRENT_ACTIVE_DOWNLOADS,
+            'active_seeds': settings.TORRENT_ACTIVE_SEEDS,
+            'active_limit': settings.TORRENT_ACTIVE_DOWNLOADS + settings.TORRENT_ACTIVE_SEEDS,
+            'request_timeout': 10,
+            'piece_timeout': 10,
+            'alert_mask': (
+                lt.alert.category_t.error_notification
+                | lt.alert.category_t.status_notification
+                | lt.alert.category_t.storage_notification
+                | lt.alert.category_t.piece_progress_notification
+                | lt.alert.category_t.file_progress_notification
+            ),
+        }
+
+    @staticmethod
+    def info_hash(handle):
+        return handle_key(handle)
+
+    @staticmethod
+    def params_key(params):
+        hashes = params.ti.info_hashes() if params.ti is not None else params.info_hashes
+        return str(hashes.v1 if hashes.has_v1() else hashes.get_best())
+
+    def add_torrent(self, params):
+        resume = self.load_resume_data(self.params_key(params))
+        if resume is not None:
+            resume.save_path = params.save_path
+            resume.storage_mode = params.storage_mode
+            params = resume
+        elif params.ti is None:
+            # A magnet for an info hash seen before starts with its metadata instead of asking peers.
+            params.ti = get_metadata_store().load(self.params_key(params))
+            if params.ti is not None:
+                print(f"[Session] Using stored metadata for {self.params_key(params)}")
+        else:
+            get_metadata_store().save(params.ti)
+        with self.lock:
+            handle = self.session.add_torrent(params)
+            key = self.info_hash(handle)
+            entry = self.handles.get(key)
+            if entry is None:
+                entry = self.handles[key] = {'handle': handle, 'refs': 0, 'files': Counter()}
+            entry['refs'] += 1
+            print(f"[Session] Torrent {key} attached ({entry['refs']} stream(s))")
+            return entry['handle']
+
+    def want_file(self, handle, file_index):
+        # Only files selected by at least one stream are downloaded; streams of the same
+        # file are counted so removing one keeps the file for the others.
+        with self.lock:
+            entry = self.handles[self.info_hash(handle)]
+            entry['files'][file_index] += 1
+            self.apply_file_priorities(entry)
+
+    @staticmethod
+    def apply_file_priorities(entry):
+        handle = entry['handle']
+        num_files = handle.torrent_file().num_files()
+        handle.prioritize_files([4 if entry['files'][index] > 0 else 0 for index in range(num_files)])
+
+    def remove_torrent(self, handle, delete_files=False, file_index=None):
+        key = self.info_hash(handle)
+        with self.lock:
+            entry = self.handles.get(key)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                print(f"[Session] Torrent {key} detached ({entry['refs']} stream(s) left)")
+                if file_index is not None and entry['files'][file_index] > 0:
+                    entry['files'][file_index] -= 1
+                    self.apply_file_priorities(entry)
+                return
+            del self.handles[key]
+            flags = lt.session.delete_files if delete_files else 0
+            self.session.remove_torrent(entry['handle'], flags)
+            self.alerts.pieces.forget(key)
+            print(f"[Session] Torrent {key} removed from session")
+        if delete_files:
+            self.delete_resume_data(key)
+
+    @staticmethod
+    def pause_torrent(handle):
+        # Auto-managed torrents would be resumed again by the queueing logic.
+        handle.unset_flags(lt.torrent_flags.auto_managed)
+        handle.pause()
+
+    @staticmethod
+    def resume_torrent(handle):
+        handle.set_flags(lt.torrent_flags.auto_managed)
+        handle.resume()
+
+    def resume_path(self, key):
+        return os.path.join(self.resume_dir, f"{key}.fastresume")
+
+    def load_resume_data(self, key):
+        path = self.resume_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                params = lt.read_resume_data(f.read())
+            print(f"[Session] Loaded resume data for {key}")
+            return params
+        except Exception as e:
+            print(f"[Session] Ignoring unreadable resume data for {key}: {e}")
+            return None
+
+    def delete_resume_data(self, key):
+        try:
+            os.remove(self.resume_path(key))
+        except FileNotFoundError:
+            pass
+
+    def save_resume_data(self, wait=False, timeout=10):
+        with self.lock:
+            handles = [entry['handle'] for entry in self.handles.values()]
+        requested = 0
+        for handle in handles:
+            if not handle.is_valid() or not handle.status().has_metadata:
+                continue
+            if not wait and not handle.need_save_resume_data():
+                continue
+            with self.resume_condition:
+                self.pending_resume += 1
+            handle.save_resume_data(lt.torrent_handle.save_info_dict)
+            requested += 1
+        if wait and requested:
+            with self.resume_condition:
+                self.resume_condition.wait_for(lambda: self.pending_resume <= 0, timeout)
+        return requested
+
+    def on_resume_data(self, alert):
+        key = handle_key(alert.handle)
+        path = self.resume_path(key)
+        try:
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(lt.write_resume_data_buf(alert.params))
+            os.replace(f"{path}.tmp", path)
+        finally:
+            self.resume_done()
+
+    @staticmethod
+    def on_metadata_received(alert):
+        get_metadata_store().save(alert.handle.torrent_file())
+
+    def on_resume_data_failed(self, alert):
+        print(f"[Session] {alert.message()}")
+        self.resume_done()
+
+    def resume_done(self):
+        with self.resume_condition:
+            self.pending_resume -= 1
+            self.resume_condition.notify_all()
+
+    def handle_status(self, handle):
+        status = handle.status()
+        return {
+            'info_hash': self.info_hash(handle),
+            'name': status.name,
+            'state': str(status.state),
+            'has_metadata': status.has_metadata,
+            'progress': status.progress,
+            'download_rate': status.download_rate,
+            'upload_rate': status.upload_rate,
+            'num_peers': status.num_peers,
+            'num_seeds': status.num_seeds,
+            'total_done': status.total_done,
+            'total_wanted': status.total_wanted,
+            'paused': bool(status.flags & lt.torrent_flags.paused),
+        }
+
+    def shutdown(self):
+        saved = self.save_resume_data(wait=True)
+        print(f"[Session] Saved resume data for {saved} torrent(s)")
+        self.alerts.stop()
+        print("[Session] Alert dispatcher stopped")
+
+    def status(self):
+        with self.lock:
+            handles = [entry['handle'] for entry in self.handles.values()]
+        return [self.handle_status(handle) for handle in handles]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = SessionManager()
+                atexit.register(_manager.shutdown)
+    return _manager
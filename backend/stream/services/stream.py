@@ -1,78 +1,51 @@
 
+from django.conf import settings
 from django.http import HttpResponse, StreamingHttpResponse
 import requests
 import libtorrent as lt
 import time
 import os
 import ffmpeg
-import subprocess
 import tempfile
 import threading
+import asyncio
 from pathlib import Path
 import mimetypes
+from .session import get_session_manager
+from .prioritizer import PiecePrioritizer
+from .cache import get_disk_cache
+from .media import get_media_store
+from .transcode import get_transcode_supervisor
+from .conversions import get_conversion_cache
+from .sendfile import offload_response, ranged_file_response
+from .aio import Signal
+from .container import index_ranges
+from .faststart import get_faststart_remuxer
+from .metadata import get_metadata_store
 
 SAVE_PATH = './_Movies'
-TORRENT_FILES_PATH = '/tmp/torrent_files'
 
 BROWSER_COMPATIBLE_FORMATS = {'.mp4', '.webm', '.ogg'}
 CONVERSION_FORMATS = {'.mkv', '.avi', '.mov', '.wmv', '.flv', '.m4v'}
 
-import datetime
-
-def cleanup_old_movies(directory=SAVE_PATH, days=30):
-    now = datetime.datetime.now().timestamp()
-    cutoff = now - days * 86400
-    removed_files = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                stat = os.stat(file_path)
-                file_age = min(stat.st_atime, stat.st_mtime, stat.st_ctime)
-                if file_age < cutoff:
-                    os.remove(file_path)
-                    removed_files.append(file_path)
-            except Exception as e:
-                print(f"[Cleanup] Failed to remove {file_path}: {e}")
-    removed_dirs = []
-    for root, dirs, files in os.walk(directory, topdown=False):
-        for d in dirs:
-            dir_path = os.path.join(root, d)
-            try:
-                if not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-                    removed_dirs.append(dir_path)
-            except Exception as e:
-                print(f"[Cleanup] Failed to remove directory {dir_path}: {e}")
-    if removed_files:
-        print(f"[Cleanup] Removed {len(removed_files)} old movie files:")
-        for f in removed_files:
-            print(f"  - {f}")
-    else:
-        print("[Cleanup] No old movie files found.")
-    if removed_dirs:
-        print(f"[Cleanup] Removed {len(removed_dirs)} empty directories:")
-        for d in removed_dirs:
-            print(f"  - {d}")
-
-def start_cleanup_timer(interval=30, file_age=30, directory=SAVE_PATH):
-    def run():
-        while True:
-            try:
-                cleanup_old_movies(directory=directory)
-            except Exception as e:
-                print(f"[Cleanup] Timer error: {e}")
-            time.sleep(3600)
-    t = threading.Thread(target=run, daemon=True)
-    t.start()
-
-
 SAVE_PATH = './_Movies'
-TORRENT_FILES_PATH = '/tmp/torrent_files'
 
 BROWSER_COMPATIBLE_FORMATS = {'.mp4', '.webm', '.ogg'}
 CONVERSION_FORMATS = {'.mkv', '.avi', '.mov', '.wmv', '.flv', '.m4v'}
 
+BROWSER_VIDEO_CODECS = {'h264', 'vp8', 'vp9', 'av1'}
+BROWSER_AUDIO_CODECS = {'aac', 'mp3', 'opus', 'vorbis', 'flac'}
+
+# Conversions are written as MP4, which cannot carry VP8 or Vorbis: those streams are re-encoded.
+MP4_COPY_VIDEO_CODECS = {'h264', 'hevc', 'av1', 'vp9'}
+MP4_COPY_AUDIO_CODECS = {'aac', 'mp3', 'opus', 'flac'}
+
+# Conversion plans, cheapest first.
+DIRECT = 'direct'
+REMUX = 'remux'
+AUDIO_TRANSCODE = 'audio'
+FULL_TRANSCODE = 'transcode'
+
 
 class VideoConverter:
     
@@ -81,10 +54,50 @@ class VideoConverter:
         return Path(file_path).suffix.lower()
     
     @staticmethod
-    def needs_conversion(file_path):
+    def needs_conversion(file_path, partial=False):
+        return VideoConverter.plan(file_path, partial=partial) != DIRECT
+
+    @staticmethod
+    def plan(file_path, wait=True, partial=False):
+        if not VideoConverter.is_video(file_path):
+            return DIRECT
+        store = get_media_store()
+        info = store.get(file_path, timeout=settings.STREAM_PROBE_WAIT, partial=partial) if wait else store.lookup(file_path)
+        return VideoConverter.plan_for(file_path, info)
+
+    @staticmethod
+    def plan_for(file_path, info):
         format_ext = VideoConverter.get_video_format(file_path)
-        return format_ext in CONVERSION_FORMATS
+        if not info or not info['video']:
+            # Not probed (yet): fall back to judging by the extension.
+            return FULL_TRANSCODE if format_ext in CONVERSION_FORMATS else DIRECT
+        video = info['video'][0]
+        audio_codec = info['audio'][0]['codec'] if info['audio'] else None
+        video_ok = video['codec'] in BROWSER_VIDEO_CODECS and video['pix_fmt'] in (None, 'yuv420p', 'yuvj420p')
+        audio_ok = audio_codec is None or audio_codec in BROWSER_AUDIO_CODECS
+        if format_ext in BROWSER_COMPATIBLE_FORMATS and video_ok and audio_ok:
+            return DIRECT
+        if not video_ok or video['codec'] not in MP4_COPY_VIDEO_CODECS:
+            return FULL_TRANSCODE
+        if not audio_ok or (audio_codec is not None and audio_codec not in MP4_COPY_AUDIO_CODECS):
+            return AUDIO_TRANSCODE
+        return REMUX
+
+    @staticmethod
+    def codec_args(plan):
+        # Only the first video and audio streams are kept: MP4 cannot carry most subtitle formats.
+        args = ['-map', '0:v:0', '-map', '0:a:0?']
+        if plan == REMUX:
+            return args + ['-c:v', 'copy', '-c:a', 'copy']
+        if plan == AUDIO_TRANSCODE:
+            return args + ['-c:v', 'copy', '-c:a', 'aac', '-ac', '2']
+        return args + ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-preset', 'ultrafast', '-tune', 'zerolatency']
     
+    @staticmethod
+    def is_video(file_path):
+        format_ext = VideoConverter.get_video_format(file_path)
+        return format_ext in BROWSER_COMPATIBLE_FORMATS or format_ext in CONVERSION_FORMATS
+
     @staticmethod
     def is_browser_compatible(file_path):
         format_ext = VideoConverter.get_video_format(file_path)
@@ -101,7 +114,7 @@ class VideoConverter:
             return 'video/mp4'
     
     @staticmethod
-    def convert_video_chunk(input_path, start_byte, chunk_size, output_format='mp4'):
+    def convert_video_chunk(input_path, start_byte, chunk_size, output_format='mp4', plan=None, partial=False):
         if not os.path.exists(input_path) or not os.path.isfile(input_path):
             raise ValueError("Invalid input path")
 
@@ -109,14 +122,17 @@ class VideoConverter:
             raise ValueError("Invalid output format")
 
         try:
-            duration_cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', 
-                            '-of', 'csv=p=0', input_path]
-            duration_result = subprocess.run(duration_cmd, capture_output=True, text=True)
-
-            if duration_result.returncode == 0:
-                total_duration = float(duration_result.stdout.strip())
+            store = get_media_store()
+            info = store.get(input_path, timeout=settings.STREAM_PROBE_WAIT, partial=partial)
+            seek_index = store.seek_index(input_path)
+
+            if seek_index:
+                # Start from the keyframe that contains the byte, not a
+                # proportional guess that is wrong for variable bitrates.
+                time_offset = seek_index.time_at(start_byte)
+            elif info and info['duration']:
                 file_size = os.path.getsize(input_path)
-                time_offset = (start_byte / file_size) * total_duration
+                time_offset = (start_byte / file_size) * info['duration']
             else:
                 time_offset = 0
 
@@ -125,17 +141,14 @@ class VideoConverter:
                 '-ss', str(time_offset),
                 '-i', input_path,
                 '-t', '10',
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
+                *VideoConverter.codec_args(plan or VideoConverter.plan_for(input_path, info)),
                 '-movflags', 'frag_keyframe+empty_moov',
                 '-f', output_format,
                 '-'
             ]
 
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            return process
+            return get_transcode_supervisor().run_job(cmd, timeout=settings.STREAM_TRANSCODE_CHUNK_TIMEOUT,
+                                                      name=f"chunk of {input_path}")
 
         except Exception as e:
             print(f"Error in video conversion: {str(e)}")
@@ -143,105 +156,288 @@ class VideoConverter:
 
 
 class TorrentStream:
-    def __init__(self):
-        if not os.path.exists("/tmp/torrent_files"):
-            os.makedirs("/tmp/torrent_files")
-        self.torrent_file_path = None
-        self.session = lt.session()
+    def __init__(self, file_index=None):
+        self.manager = get_session_manager()
         self.torrent_info = None
         self.handle = None
-        self.session.listen_on(6881, 6891)
 
         self.movie_path = None
+        self.file_index = file_index
+        self.wanted_file = None
+        self.file_offset = 0
         self.file_size = None
-        self.start_byte = 0
-        self.end_byte = None
         self.piece_size = None
+        self.prioritizer = None
         self.converter = VideoConverter()
 
-        try:
-            start_cleanup_timer()
-        except Exception as e:
-            print(f"[Cleanup] Error starting cleanup timer: {e}")
+        self.source = None
+        self.last_read = time.monotonic()
+        self.paused = False
+        self.state = 'queued'
+        self.error = None
+        self.buffer_pieces = []
+        self.metadata_ready = Signal()
+        self.cache_title = None
+        # Set when the stream is removed; a start still in flight releases what it attaches.
+        self.cancelled = False
+        self.attached = False
+        self.lock = threading.Lock()
 
     def init_torrent_file(self, torrent_url):
-        response = requests.get(torrent_url)
-        self.torrent_file_path = f"{TORRENT_FILES_PATH}/{torrent_url.split('/')[-1].split('.')[0]}.torrent"
+        store = get_metadata_store()
+        self.torrent_info = store.for_url(torrent_url)
+        if self.torrent_info is not None:
+            print("Torrent metadata already stored.")
+            return
+        response = requests.get(torrent_url, timeout=settings.STREAM_TORRENT_DOWNLOAD_TIMEOUT)
 
         if response.status_code == 200:
-            if not os.path.exists(self.torrent_file_path):
-                with open(self.torrent_file_path, 'wb') as f:
-                    f.write(response.content)
-                print("Torrent file downloaded successfully.")
-            else:
-                print("Torrent file already exists.")
+            try:
+                self.torrent_info = lt.torrent_info(response.content)
+            except RuntimeError as e:
+                raise IOError(f"Invalid torrent file: {e}")
+            store.save(self.torrent_info, url=torrent_url)
+            print("Torrent file downloaded successfully.")
         else:
-            print(
+            raise IOError(
                 f"Failed to download the torrent. Status code: {response.status_code}")
 
+    def start(self, magnet_link=None, torrent_url=None):
+        try:
+            if self.cancelled:
+                return
+            self.state = 'fetching_metadata'
+            if torrent_url:
+                self.init_torrent_file(torrent_url)
+            self.add_torrent(magnet_link)
+            self.metadata_ready.set()
+            self.state = 'buffering'
+            for piece_index in self.buffer_pieces:
+                # A slow swarm is not a failure: reads keep working, so the buffer keeps waiting.
+                while True:
+                    try:
+                        self.manager.alerts.wait_for_piece(self.handle, piece_index, settings.STREAM_PIECE_TIMEOUT)
+                        break
+                    except TimeoutError:
+                        if self.cancelled:
+                            return
+                        if self.state != 'stalled':
+                            self.state = 'stalled'
+                            print(f"====> Buffering stalled at piece {piece_index}: {self.movie_path}")
+                self.state = 'buffering'
+            self.state = 'ready'
+            get_media_store().schedule(self.movie_path, partial=not self.is_complete())
+            print(f"====> Stream ready: {self.movie_path}")
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            print(f"====> Stream initialization failed: {e}")
+        finally:
+            self.metadata_ready.set()
+
+    def touch(self):
+        self.last_read = time.monotonic()
+        if self.paused:
+            self.paused = False
+            self.manager.resume_torrent(self.handle)
+            print(f"====> Resumed idle stream: {self.movie_path}")
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_read
+
+    def pause(self):
+        if self.paused or self.handle is None:
+            return
+        self.paused = True
+        self.manager.pause_torrent(self.handle)
+        print(f"====> Paused idle stream: {self.movie_path}")
+
+    def info_hash(self):
+        return self.manager.info_hash(self.handle) if self.handle is not None else None
+
+    def wait_until_started(self, timeout):
+        if not self.metadata_ready.wait(timeout):
+            raise TimeoutError(f"Timed out after {timeout}s waiting for torrent metadata")
+        if self.movie_path is None:
+            raise IOError(self.error or 'Stream initialization failed')
+
+    async def wait_until_started_async(self, timeout):
+        if not await self.metadata_ready.wait_async(timeout):
+            raise TimeoutError(f"Timed out after {timeout}s waiting for torrent metadata")
+        if self.movie_path is None:
+            raise IOError(self.error or 'Stream initialization failed')
+
+    def progress(self):
+        metadata_progress = 0.0
+        if self.handle is not None:
+            status = self.handle.status()
+            metadata_progress = 1.0 if status.has_metadata else status.progress
+        buffer_progress = 0.0
+        if self.buffer_pieces:
+            done = sum(1 for piece in self.buffer_pieces if self.handle.have_piece(piece))
+            buffer_progress = done / len(self.buffer_pieces)
+        return {
+            'state': self.state,
+            'error': self.error,
+            'paused': self.paused,
+            'idle_seconds': round(self.idle_seconds()),
+            'metadata_progress': round(metadata_progress, 3),
+            'buffer_progress': round(buffer_progress, 3),
+            'file_index': self.file_index if self.movie_path else None,
+            'files': self.list_files(),
+        }
+
+    def list_files(self):
+        if self.torrent_info is None:
+            return []
+        files = self.torrent_info.files()
+        return [{
+            'index': index,
+            'path': files.file_path(index),
+            'size': files.file_size(index),
+            'is_video': VideoConverter.is_video(files.file_path(index)),
+            'selected': self.movie_path is not None and index == self.file_index,
+        } for index in self.media_files()]
+
+    def media_files(self):
+        # Pad files only exist to align v2 pieces and never hold data.
+        files = self.torrent_info.files()
+        return [index for index in range(files.num_files())
+                if not files.file_flags(index) & lt.file_storage.flag_pad_file]
+
+    def select_file(self, file_index=None):
+        files = self.torrent_info.files()
+        media_files = self.media_files()
+        if file_index is not None:
+            if file_index not in media_files:
+                raise ValueError(f"File index {file_index} does not exist in this torrent")
+            return file_index
+        candidates = [index for index in media_files if VideoConverter.is_video(files.file_path(index))]
+        return max(candidates or media_files, key=files.file_size)
+
     def add_torrent(self, magnet_link=None):
         if magnet_link:
             print(f"====> Adding torrent from magnet link: {magnet_link}")
             params = lt.parse_magnet_uri(magnet_link)
             params.save_path = SAVE_PATH
             params.storage_mode = lt.storage_mode_t.storage_mode_sparse
-            self.handle = self.session.add_torrent(params)
         else:
-            print(f"====> Adding torrent from file: {self.torrent_file_path}")
-            self.torrent_info = lt.torrent_info(self.torrent_file_path)
-            self.handle = self.session.add_torrent(
-                {'ti': self.torrent_info, 'save_path': SAVE_PATH, 'storage_mode': lt.storage_mode_t.storage_mode_allocate})
+            print(f"====> Adding torrent from file: {self.torrent_info.name()}")
+            params = lt.add_torrent_params()
+            params.ti = self.torrent_info
+            params.save_path = SAVE_PATH
+            params.storage_mode = lt.storage_mode_t.storage_mode_sparse
+        handle = self.manager.add_torrent(params)
+        with self.lock:
+            self.handle = handle
+            self.attached = True
+            self.check_cancelled()
 
         print("====> Waiting for metadata...")
-        while not self.handle.status().has_metadata:
-            time.sleep(.5)
+        self.manager.alerts.wait_for_metadata(self.handle, settings.STREAM_METADATA_TIMEOUT)
         print("====> Metadata received successfully.")
 
         # Get torrent info from handle after metadata is received
         self.torrent_info = self.handle.torrent_file()
-        self.movie_path = os.path.join(SAVE_PATH, self.torrent_info.files().file_path(0))
-        self.file_size = self.torrent_info.files().file_size(0)
-        self.handle.read_piece(0)
+        self.piece_size = self.torrent_info.piece_length()
+        self.file_index = self.select_file(self.file_index)
+        with self.lock:
+            self.check_cancelled()
+            self.manager.want_file(self.handle, self.file_index)
+            self.wanted_file = self.file_index
+        files = self.torrent_info.files()
+        self.file_offset = files.file_offset(self.file_index)
+        self.file_size = files.file_size(self.file_index)
+        first_piece = self.piece_at(0)
+        last_piece = self.piece_at(self.file_size - 1)
+        self.prioritizer = PiecePrioritizer(self.handle, self.torrent_info, first_piece, last_piece)
+        # Players read the head and the tail (moov, Cues, idx1) before the first frame.
+        self.prioritizer.pin({first_piece, last_piece})
+        # Left for the first range request to continue.
+        self.prioritizer.on_request(first_piece)
+        self.prioritizer.release(None)
+        self.buffer_pieces = list(range(first_piece, min(first_piece + settings.STREAM_BUFFER_PIECES - 1, last_piece) + 1))
+        self.movie_path = os.path.join(SAVE_PATH, files.file_path(self.file_index))
+        with self.lock:
+            self.check_cancelled()
+            self.cache_title = get_disk_cache().pin(self.movie_path, self.file_size, info_hash=self.info_hash())
+        print(f"====> Selected file {self.file_index}: {self.movie_path}")
         print(f"====> File size: {self.file_size}")
+        threading.Thread(target=self.pin_container_index, name='container-index', daemon=True).start()
+
+    def pin_container_index(self):
+        # The index may sit anywhere in the file; its pieces are pinned as soon as it is located.
+        try:
+            ranges = index_ranges(self.read_bytes, self.file_size)
+        except Exception as e:
+            print(f"[Container] Could not locate the index of {self.movie_path}: {e}")
+            return
+        for start, end in ranges:
+            end = min(end, start + settings.STREAM_INDEX_MAX_BYTES)
+            pieces = range(self.piece_at(start), self.piece_at(end - 1) + 1)
+            self.prioritizer.pin(pieces)
+            print(f"[Container] Pinned {len(pieces)} index piece(s) at byte {start} of {self.movie_path}")
+
+    def read_bytes(self, position, size):
+        # Blocking read through libtorrent for the container parsers; pieces it needs are pinned.
+        end = min(position + size, self.file_size)
+        data = b''
+        while position < end:
+            piece_index = self.piece_at(position)
+            self.prioritizer.pin([piece_index])
+            self.manager.alerts.wait_for_piece(self.handle, piece_index, settings.STREAM_PIECE_TIMEOUT)
+            piece = self.manager.alerts.read_piece(self.handle, piece_index, settings.STREAM_PIECE_TIMEOUT)
+            piece_start = self.piece_start(piece_index)
+            chunk = piece[position - piece_start:end - piece_start]
+            if not chunk:
+                break
+            data += chunk
+            position += len(chunk)
+        return data
+
+    def is_complete(self):
+        return self.handle.file_progress()[self.file_index] == self.file_size
+
+    def piece_at(self, position):
+        return (self.file_offset + position) // self.piece_size
+
+    def piece_start(self, piece_index):
+        # Position of the first byte of a piece, relative to the start of the selected file.
+        return piece_index * self.piece_size - self.file_offset
 
     def parse_chunk_range(self, vrange):
         start, end = vrange.replace('bytes=', '').split('-')
         start = int(start)
         end = int(end) if end else None
-        self.piece_size = self.torrent_info.piece_length()
         print(f"====> Piece size: {self.piece_size}")
-        piece_index = start // self.piece_size
+        piece_index = self.piece_at(start)
         return {'piece_index': piece_index, 'start': start, 'end': end}
 
-    def stream_torrent(self, vrange):
+    def open_range(self, vrange):
+        # Each request reads through its own reader, so overlapping requests never share range state.
         parsed_range = self.parse_chunk_range(vrange)
-        piece_index = parsed_range['piece_index']
-        self.start_byte = parsed_range['start']
-        self.end_byte = parsed_range['end']
-
-        print(f"====> Reading piece: {piece_index}")
-        self.handle.read_piece(piece_index)
-        while not self.handle.have_piece(piece_index):
-            time.sleep(.5)
-
-        video_path = os.path.join(
-            SAVE_PATH, self.torrent_info.files().file_path(0))
-        
-        if self.converter.needs_conversion(video_path):
-            print(f"====> Video format requires conversion: {video_path}")
-            return self.stream_converted_video(video_path, self.start_byte)
-        else:
-            with open(video_path, 'rb') as f:
-                f.seek(self.start_byte)
-                return f.read(self.piece_size)
+        start_byte = parsed_range['start']
+        self.touch()
+        if start_byte >= self.file_size:
+            raise ValueError(f"Range start {start_byte} is beyond the end of the file ({self.file_size})")
+        last_byte = start_byte + settings.STREAM_MAX_RESPONSE_SPAN - 1
+        if parsed_range['end'] is not None:
+            last_byte = min(last_byte, parsed_range['end'])
+        reader = TorrentRangeReader(self, start_byte, min(last_byte, self.file_size - 1))
+
+        print(f"====> Reading piece: {reader.piece_index}")
+        self.prioritizer.on_request(reader.piece_index, reader)
+        return reader
 
     def stream_converted_video(self, video_path, start_byte):
         try:
-            process = self.converter.convert_video_chunk(video_path, start_byte, self.piece_size)
-            if process:
-                converted_data = process.stdout.read(self.piece_size)
-                process.terminate()
-                return converted_data
+            job = self.converter.convert_video_chunk(video_path, start_byte, self.piece_size,
+                                                     partial=not self.is_complete())
+            if job:
+                try:
+                    return job.stdout.read(self.piece_size)
+                finally:
+                    job.stop()
             else:
                 with open(video_path, 'rb') as f:
                     f.seek(start_byte)
@@ -252,26 +448,42 @@ class TorrentStream:
                 f.seek(start_byte)
                 return f.read(self.piece_size)
 
-    def create_response(self, data):
-        video_path = os.path.join(SAVE_PATH, self.torrent_info.files().file_path(0))
-        content_type = self.converter.get_content_type(video_path)
-        
-        response = HttpResponse(data, content_type=content_type, status=206)
-        self.end_byte = self.start_byte + len(data) - 1
-        print(f"====> Chunk size after: {len(data)}")
-        print(f"====> Content-Type: {content_type}")
-        print(
-            f"====> Start byte: {self.start_byte} - End byte: {self.end_byte} - File size: {self.file_size}")
-        response['Content-Range'] = f"bytes {self.start_byte}-{self.end_byte}/{self.file_size}"
-        response['Accept-Ranges'] = 'bytes'
-        response['Content-Length'] = len(data)
-        return response
+    def needs_conversion(self):
+        return self.converter.needs_conversion(self.movie_path, partial=not self.is_complete())
 
     def remove_stream(self):
-        self.session.remove_torrent(self.handle)
+        with self.lock:
+            self.cancelled = True
+            self.release()
+
+    def check_cancelled(self):
+        # Called with the lock held while starting: a stream removed before it got here
+        # has nobody left to release the handle, so it does that itself.
+        if self.cancelled:
+            self.release()
+            raise IOError('Stream was removed while starting')
+
+    def release(self):
+        if self.attached:
+            self.attached = False
+            self.manager.remove_torrent(self.handle, file_index=self.wanted_file)
+        if self.cache_title is not None:
+            get_disk_cache().unpin(self.cache_title)
+            self.cache_title = None
+
+    def status(self):
+        if self.handle is None:
+            return None
+        status = self.manager.handle_status(self.handle)
+        if self.prioritizer:
+            status['playback'] = self.prioritizer.metrics()
+        status['piece_cache'] = self.manager.alerts.pieces.stats()
+        if self.movie_path:
+            status['media'] = get_media_store().lookup(self.movie_path)
+        return status
 
     async def convert_video(self):
-        if self.movie_path and self.converter.needs_conversion(self.movie_path):
+        if self.movie_path and self.needs_conversion():
             print(f"====> Converting video {self.movie_path} to browser-compatible format...")
             return True
         else:
@@ -279,7 +491,95 @@ class TorrentStream:
             return False
 
     def __str__(self):
-        return f"TorrentStream object with torrent file path: {self.torrent_info.files().file_path(0)}"
+        if self.movie_path is None:
+            return f"TorrentStream object ({self.state})"
+        return f"TorrentStream object with torrent file path: {self.movie_path}"
+
+
+class TorrentRangeReader:
+    """One request's byte range of a TorrentStream."""
+
+    def __init__(self, stream, start_byte, end_byte):
+        self.stream = stream
+        self.start_byte = start_byte
+        self.end_byte = end_byte
+        self.piece_index = stream.piece_at(start_byte)
+
+    async def read_async(self):
+        # Bytes for a conversion, otherwise an async generator over the range.
+        # Buffering clients wait as coroutines instead of threads.
+        stream = self.stream
+        try:
+            await stream.manager.alerts.wait_for_piece_async(stream.handle, self.piece_index, settings.STREAM_PIECE_TIMEOUT)
+            if await asyncio.to_thread(stream.needs_conversion):
+                print(f"====> Video format requires conversion: {stream.movie_path}")
+                return await asyncio.to_thread(stream.stream_converted_video, stream.movie_path, self.start_byte)
+        except BaseException:
+            self.close()
+            raise
+        return self.aiter_pieces()
+
+    def close(self):
+        # Hands the reader's window back; the next sequential request may continue it.
+        self.stream.prioritizer.release(self)
+
+    def request_piece(self, piece_index):
+        # The libtorrent calls for a piece, which the async reader makes from a worker thread.
+        self.stream.touch()
+        self.stream.prioritizer.on_request(piece_index, self)
+        return self.stream.handle.have_piece(piece_index)
+
+    def piece_slice(self, position, piece_index, piece):
+        piece_start = self.stream.piece_start(piece_index)
+        piece_end = min(piece_start + self.stream.piece_size - 1, self.end_byte)
+        return piece[position - piece_start:piece_end - piece_start + 1]
+
+    async def aiter_pieces(self):
+        # Yields the range piece by piece, waiting for each piece as the window reaches it.
+        # Pieces are read through libtorrent: a verified piece may not be flushed to the file yet.
+        stream = self.stream
+        alerts = stream.manager.alerts
+        position = self.start_byte
+        try:
+            while position <= self.end_byte:
+                piece_index = stream.piece_at(position)
+                try:
+                    if not await asyncio.to_thread(self.request_piece, piece_index):
+                        await alerts.wait_for_piece_async(stream.handle, piece_index, settings.STREAM_PIECE_TIMEOUT)
+                    piece = await alerts.read_piece_async(stream.handle, piece_index, settings.STREAM_PIECE_TIMEOUT)
+                except (TimeoutError, IOError) as e:
+                    print(f"====> Stopping response at byte {position}: {e}")
+                    return
+                data = self.piece_slice(position, piece_index, piece)
+                if not data:
+                    return
+                if position == self.start_byte:
+                    stream.prioritizer.on_first_byte(self)
+                position += len(data)
+                yield data
+        finally:
+            self.close()
+
+    def create_response(self, data):
+        stream = self.stream
+        content_type = stream.converter.get_content_type(stream.movie_path)
+
+        if isinstance(data, bytes):
+            response = HttpResponse(data, content_type=content_type, status=206)
+            self.end_byte = self.start_byte + len(data) - 1
+            stream.prioritizer.on_first_byte(self)
+            self.close()
+        else:
+            response = StreamingHttpResponse(data, content_type=content_type, status=206)
+        content_length = self.end_byte - self.start_byte + 1
+        print(f"====> Chunk size after: {content_length}")
+        print(f"====> Content-Type: {content_type}")
+        print(
+            f"====> Start byte: {self.start_byte} - End byte: {self.end_byte} - File size: {stream.file_size}")
+        response['Content-Range'] = f"bytes {self.start_byte}-{self.end_byte}/{stream.file_size}"
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Length'] = content_length
+        return response
 
 
 class StoredMovieStream:
@@ -290,6 +590,9 @@ class StoredMovieStream:
         self.converter = VideoConverter()
         self.start_byte = 0
         self.end_byte = None
+        if self.file_size and self.converter.is_video(movie_path):
+            # Probes in the background the first time a file is requested.
+            get_media_store().get(movie_path)
     
     def parse_range_header(self, range_header):
         if not range_header:
@@ -324,15 +627,13 @@ class StoredMovieStream:
     
     def stream_converted_movie_simple(self):
         try:
-            print(f"====> Starting simple FFmpeg conversion")
+            plan = self.converter.plan(self.movie_path)
+            print(f"====> Starting simple FFmpeg conversion ({plan})")
             
             cmd = [
                 'ffmpeg',
                 '-i', self.movie_path,
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
+                *self.converter.codec_args(plan),
                 '-movflags', 'frag_keyframe+empty_moov+faststart',
                 '-f', 'mp4',
                 'pipe:1'
@@ -340,18 +641,13 @@ class StoredMovieStream:
             
             print(f"====> FFmpeg command: {' '.join(cmd)}")
             
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                bufsize=0
-            )
+            job = get_transcode_supervisor().run_job(cmd, name=f"conversion of {self.movie_path}")
             
             chunk_size = 64 * 1024
             
             try:
                 while True:
-                    data = process.stdout.read(chunk_size)
+                    data = job.stdout.read1(chunk_size)
                     if not data:
                         print("====> FFmpeg conversion completed")
                         break
@@ -360,11 +656,7 @@ class StoredMovieStream:
             except Exception as e:
                 print(f"====> Error during FFmpeg streaming: {str(e)}")
             finally:
-                try:
-                    process.terminate()
-                    process.wait(timeout=5)
-                except:
-                    process.kill()
+                job.stop()
                     
         except Exception as e:
             print(f"Error in streaming conversion: {str(e)}")
@@ -390,14 +682,36 @@ class StoredMovieStream:
                 remaining -= len(data)
                 yield data
     
+    def pinned(self, chunks):
+        # Keeps the title out of disk cache eviction while it is being read.
+        cache = get_disk_cache()
+        title = cache.pin(self.movie_path)
+        try:
+            yield from chunks
+        finally:
+            if title is not None:
+                cache.unpin(title)
+
     def create_streaming_response(self, range_header=None):
         content_type = self.converter.get_content_type(self.movie_path)
         
         if self.converter.needs_conversion(self.movie_path):
+            plan = self.converter.plan(self.movie_path)
+            try:
+                conversion = get_conversion_cache().get(self.movie_path, plan, self.converter.codec_args(plan))
+            except IOError as e:
+                print(f"====> {e}")
+                conversion = None
+            if conversion is not None:
+                if conversion.complete():
+                    print(f"====> Serving cached conversion {conversion.path}")
+                    return StoredMovieStream(conversion.path).create_file_response(range_header)
+                return self.create_partial_response(conversion, range_header)
+
             print("====> Creating streaming response for converted file (no range support)")
             
             def generate():
-                yield from self.stream_movie()
+                yield from self.pinned(self.stream_movie())
             
             response = StreamingHttpResponse(
                 generate(),
@@ -407,34 +721,89 @@ class StoredMovieStream:
             
             response['Accept-Ranges'] = 'none'
             response['Cache-Control'] = 'no-cache'
-            
-        else:
-            if range_header:
-                range_info = self.parse_range_header(range_header)
-                if range_info:
-                    self.start_byte = range_info['start']
-                    self.end_byte = range_info['end']
-            
-            if not self.end_byte:
-                self.end_byte = self.file_size - 1
-            
+            return response
+
+        faststart = get_faststart_remuxer().ready_path(self.movie_path)
+        if faststart is not None:
+            print(f"====> Serving faststart copy {faststart}")
+            return StoredMovieStream(faststart).create_file_response(range_header)
+        return self.create_file_response(range_header)
+
+    def create_file_response(self, range_header=None):
+        content_type = self.converter.get_content_type(self.movie_path)
+        if range_header:
+            range_info = self.parse_range_header(range_header)
+            if range_info:
+                self.start_byte = range_info['start']
+                self.end_byte = range_info['end']
+        
+        if not self.end_byte:
+            self.end_byte = self.file_size - 1
+        
+        mode = settings.STREAM_SENDFILE_MODE
+        response = offload_response(self.movie_path, content_type) if mode in ('x-accel', 'x-sendfile') else None
+        if response is not None:
+            get_disk_cache().touch(self.movie_path)
+            return response
+
+        if mode == 'python':
             def generate():
-                yield from self.stream_movie(range_header)
+                chunk_size = min(1024 * 1024, self.end_byte - self.start_byte + 1)
+                yield from self.pinned(self.stream_original_movie(chunk_size))
             
             response = StreamingHttpResponse(
                 generate(),
                 content_type=content_type,
                 status=206 if range_header else 200
             )
-            
-            if range_header:
-                content_length = self.end_byte - self.start_byte + 1
-                response['Content-Range'] = f'bytes {self.start_byte}-{self.end_byte}/{self.file_size}'
-                response['Content-Length'] = str(content_length)
-            else:
-                response['Content-Length'] = str(self.file_size)
-            
-            response['Accept-Ranges'] = 'bytes'
-            response['Cache-Control'] = 'no-cache'
+        else:
+            cache = get_disk_cache()
+            title = cache.pin(self.movie_path)
+            response = ranged_file_response(
+                self.movie_path, self.start_byte, self.end_byte, content_type,
+                status=206 if range_header else 200,
+                on_close=(lambda: cache.unpin(title)) if title is not None else None,
+            )
+        
+        if range_header:
+            content_length = self.end_byte - self.start_byte + 1
+            response['Content-Range'] = f'bytes {self.start_byte}-{self.end_byte}/{self.file_size}'
+            response['Content-Length'] = str(content_length)
+        else:
+            response['Content-Length'] = str(self.file_size)
+        
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = 'no-cache'
         
         return response
+
+    def create_partial_response(self, conversion, range_header=None):
+        # Serves what has been converted so far; the total length is unknown until it finishes.
+        if not conversion.cached:
+            # Without a cache file byte positions are not stable: every viewer joins the live output.
+            response = StreamingHttpResponse(self.pinned(conversion.join_live()), content_type='video/mp4', status=200)
+            response['Accept-Ranges'] = 'none'
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        start, end = 0, None
+        if range_header:
+            range_match = range_header.replace('bytes=', '').split('-')
+            start = int(range_match[0]) if range_match[0] else 0
+            end = int(range_match[1]) if range_match[1] else None
+        conversion.wait_for(start, settings.STREAM_CONVERSION_WAIT)
+        if conversion.complete():
+            return StoredMovieStream(conversion.path).create_file_response(range_header)
+
+        if range_header:
+            available = conversion.available()
+            end = available - 1 if end is None else min(end, available - 1)
+            response = StreamingHttpResponse(self.pinned(conversion.read(start, end)), content_type='video/mp4', status=206)
+            response['Content-Range'] = f'bytes {start}-{end}/*'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            # Plain players get the whole conversion as it is written.
+            response = StreamingHttpResponse(self.pinned(conversion.read(0)), content_type='video/mp4', status=200)
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = 'no-cache'
+        return response
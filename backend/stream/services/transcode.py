@@ -0,0 +1,216 @@
+import atexit
+import heapq
+import itertools
+import subprocess
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+# Job priorities; lower runs first.
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class TranscodeJob:
+    """An ffmpeg command queued on or run by the TranscodeSupervisor."""
+
+    def __init__(self, supervisor, cmd, priority, timeout, name, stdout, on_exit, on_output):
+        self.supervisor = supervisor
+        self.cmd = cmd
+        self.priority = priority
+        self.timeout = timeout
+        self.name = name
+        self.stdout_target = stdout
+        self.on_exit = on_exit
+        self.on_output = on_output
+        self.process = None
+        self.state = 'queued'
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.started = threading.Event()
+        self.log = deque(maxlen=settings.STREAM_TRANSCODE_LOG_LINES)
+
+    @property
+    def stdout(self):
+        return self.process.stdout if self.process else None
+
+    @property
+    def returncode(self):
+        return self.process.returncode if self.process else None
+
+    def done(self):
+        return self.state in ('finished', 'cancelled')
+
+    def wait_started(self, timeout):
+        if not self.started.wait(timeout):
+            self.stop()
+            raise TimeoutError(f"{self.name} waited more than {timeout}s for a transcode slot")
+        if self.process is None:
+            raise IOError(f"{self.name} was cancelled before it started")
+
+    def stop(self):
+        self.supervisor.stop(self)
+
+    def drain(self):
+        # Keeps the pipe from filling up and blocking ffmpeg; the tail is printed if it fails.
+        # Lines on_output(line) returns True for are progress, not kept for the log.
+        for line in self.process.stderr:
+            line = line.decode(errors='replace').rstrip()
+            if self.on_output is not None and self.on_output(line):
+                continue
+            self.log.append(line)
+
+
+class TranscodeSupervisor:
+    """Runs ffmpeg under a global process limit, interactive jobs first, and reaps every process."""
+
+    def __init__(self):
+        self.limit = settings.STREAM_TRANSCODE_MAX_PROCESSES
+        self.queue = []
+        self.jobs = set()
+        self.sequence = itertools.count()
+        self.counters = Counter()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='transcode-supervisor', daemon=True)
+        self.thread.start()
+
+    def submit(self, cmd, priority=INTERACTIVE, timeout=None, name=None, stdout=subprocess.DEVNULL, on_exit=None,
+               on_output=None):
+        # on_exit(job) is called once the process has been reaped, or the job was cancelled.
+        job = TranscodeJob(self, cmd, priority, timeout or settings.STREAM_TRANSCODE_TIMEOUT, name or cmd[0],
+                           stdout, on_exit, on_output)
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.sequence), job))
+            self.counters['submitted'] += 1
+            failed = self.dispatch()
+        for failed_job in failed:
+            self.notify_exit(failed_job)
+        return job
+
+    def run_job(self, cmd, priority=INTERACTIVE, timeout=None, name=None, stdout=subprocess.PIPE):
+        # Blocks until the job has a slot; the caller must stop() it when done.
+        job = self.submit(cmd, priority, timeout, name, stdout)
+        job.wait_started(settings.STREAM_TRANSCODE_QUEUE_TIMEOUT)
+        return job
+
+    def dispatch(self):
+        # Returns the jobs that could not be started. Their exit handlers may take other
+        # locks, so callers run them after releasing the condition.
+        failed = []
+        while len(self.jobs) < self.limit and self.queue:
+            _, _, job = heapq.heappop(self.queue)
+            if job.state == 'queued' and not self.launch(job):
+                failed.append(job)
+        return failed
+
+    def launch(self, job):
+        # -threads goes right before the output so it applies to the encoder.
+        cmd = job.cmd[:-1] + ['-threads', str(settings.STREAM_TRANSCODE_THREADS)] + job.cmd[-1:]
+        try:
+            job.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=job.stdout_target,
+                                           stderr=subprocess.PIPE)
+        except OSError as e:
+            print(f"[Transcode] Could not start {job.name}: {e}")
+            job.state = 'cancelled'
+            self.counters['failed'] += 1
+            job.started.set()
+            return False
+        job.state = 'running'
+        job.started_at = time.monotonic()
+        self.jobs.add(job)
+        self.counters['started'] += 1
+        threading.Thread(target=job.drain, name='transcode-stderr', daemon=True).start()
+        job.started.set()
+        return True
+
+    def stop(self, job):
+        with self.condition:
+            cancelled = job.state == 'queued'
+            if cancelled:
+                job.state = 'cancelled'
+                self.counters['cancelled'] += 1
+                job.started.set()
+        if cancelled:
+            self.notify_exit(job)
+        else:
+            self.reap(job, kill=True)
+
+    @staticmethod
+    def notify_exit(job):
+        if job.on_exit is not None:
+            try:
+                job.on_exit(job)
+            except Exception as e:
+                print(f"[Transcode] Exit handler of {job.name} failed: {e}")
+
+    def reap(self, job, kill=False):
+        if kill and job.process.poll() is None:
+            job.process.kill()
+        job.process.wait()
+        with self.condition:
+            if job not in self.jobs:
+                return
+            self.jobs.discard(job)
+            job.state = 'finished'
+            if job.process.returncode not in (0, -9) and not kill:
+                self.counters['failed'] += 1
+                print(f"[Transcode] {job.name} exited with {job.process.returncode}: {' | '.join(job.log)}")
+            else:
+                self.counters['finished'] += 1
+            failed = self.dispatch()
+        self.notify_exit(job)
+        for failed_job in failed:
+            self.notify_exit(failed_job)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait(1)
+                if not self.running:
+                    return
+                jobs = list(self.jobs)
+            now = time.monotonic()
+            for job in jobs:
+                if job.process.poll() is not None:
+                    self.reap(job)
+                elif now - job.started_at > job.timeout:
+                    print(f"[Transcode] Killing {job.name} after {job.timeout}s")
+                    self.counters['timeouts'] += 1
+                    self.reap(job, kill=True)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'running': len(self.jobs),
+                'queued': sum(1 for _, _, job in self.queue if job.state == 'queued'),
+                **self.counters,
+            }
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            jobs = list(self.jobs)
+            for _, _, job in self.queue:
+                job.state = 'cancelled'
+                job.started.set()
+            self.condition.notify()
+        for job in jobs:
+            self.reap(job, kill=True)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_transcode_supervisor():
+    global _supervisor
+    if _supervisor is None:
+        with _supervisor_lock:
+            if _supervisor is None:
+                _supervisor = TranscodeSupervisor()
+                atexit.register(_supervisor.shutdown)
+    return _supervisor
@@ -1,3 +1,131 @@
-from django.test import TestCase
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import libtorrent as lt
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import views
+from .services import stream as stream_module
+from .services.registry import get_stream_registry
+
+STATE_DIR = tempfile.mkdtemp(prefix='stream-test-state-')
+
+
+@override_settings(TORRENT_LISTEN_INTERFACES='127.0.0.1:0', TORRENT_DHT_BOOTSTRAP_NODES='',
+                   STREAM_STATE_DIR=STATE_DIR, STREAM_AUTOSTART=False)
+class ConcurrentRangeTests(SimpleTestCase):
+    """Many overlapping range requests against one torrent, served by a local seeder."""
+
+    file_size = 6 * 1024 * 1024 + 12345
+    piece_size = 64 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.seed_dir = tempfile.mkdtemp(prefix='stream-test-seed-')
+        cls.save_dir = tempfile.mkdtemp(prefix='stream-test-save-')
+        os.makedirs(os.path.join(cls.seed_dir, 'Movie'))
+        cls.data = random.Random(0).randbytes(cls.file_size)
+        with open(os.path.join(cls.seed_dir, 'Movie', 'movie.mp4'), 'wb') as f:
+            f.write(cls.data)
+
+        files = lt.file_storage()
+        lt.add_files(files, os.path.join(cls.seed_dir, 'Movie'))
+        torrent = lt.create_torrent(files, cls.piece_size)
+        lt.set_piece_hashes(torrent, cls.seed_dir)
+        info = lt.torrent_info(torrent.generate())
+        cls.seeder = lt.session({'listen_interfaces': '127.0.0.1:0', 'enable_dht': False, 'enable_lsd': False})
+        params = lt.add_torrent_params()
+        params.ti = info
+        params.save_path = cls.seed_dir
+        seed = cls.seeder.add_torrent(params)
+        deadline = time.monotonic() + 30
+        while not seed.status().is_seeding and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        cls.patch = mock.patch.object(stream_module, 'SAVE_PATH', cls.save_dir)
+        cls.patch.start()
+        cls.stream_id = str(info.info_hashes().v1)
+        request = RequestFactory().get('/stream/init/', {'torrent_hash': cls.stream_id, 'movie_name': 'Movie'})
+        asyncio.run(views.init_torrent_file(request))
+        cls.ts = get_stream_registry().get(cls.stream_id)
+        while cls.ts.handle is None and cls.ts.state != 'failed' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        cls.ts.handle.connect_peer(('127.0.0.1', cls.seeder.listen_port()))
+        cls.ts.wait_until_started(30)
+
+    @classmethod
+    def tearDownClass(cls):
+        get_stream_registry().remove(cls.stream_id)
+        cls.patch.stop()
+        del cls.seeder
+        shutil.rmtree(cls.seed_dir, ignore_errors=True)
+        shutil.rmtree(cls.save_dir, ignore_errors=True)
+        super().tearDownClass()
+
+    def overlapping_ranges(self, count):
+        # Head probes, moov probes at the end and playback positions, all overlapping.
+        rng = random.Random(count)
+        ranges = [(0, None), (0, 1), (self.file_size - 100000, None)]
+        while len(ranges) < count:
+            start = rng.randrange(self.file_size)
+            end = rng.choice([None, min(start + rng.randrange(1, 3 * self.piece_size), self.file_size - 1)])
+            ranges.append((start, end))
+        return ranges
+
+    def assert_exact(self, start, end, response, body):
+        first, last = response['Content-Range'].split(' ')[1].split('/')[0].split('-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(int(first), start)
+        if end is not None:
+            self.assertEqual(int(last), end)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(body, self.data[start:int(last) + 1])
+
+    def read_range(self, start, end):
+        # Reads through the range reader the async views use, on the caller's own event loop.
+        async def fetch():
+            reader = await asyncio.to_thread(self.ts.open_range, f"bytes={start}-{'' if end is None else end}")
+            response = reader.create_response(await reader.read_async())
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        return asyncio.run(fetch())
+
+    def test_concurrent_readers_from_threads(self):
+        def fetch(byte_range):
+            return (byte_range, *self.read_range(*byte_range))
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(fetch, self.overlapping_ranges(64)))
+        for (start, end), response, body in results:
+            self.assert_exact(start, end, response, body)
+
+    def test_concurrent_requests_to_async_view(self):
+        factory = RequestFactory()
+
+        async def fetch(start, end):
+            request = factory.get('/stream/', {'stream_id': self.stream_id},
+                                  HTTP_RANGE=f"bytes={start}-{'' if end is None else end}")
+            response = await views.stream_torrent(request)
+            body = b''.join([chunk async for chunk in response.streaming_content])
+            return start, end, response, body
+
+        async def fetch_all():
+            return await asyncio.gather(*(fetch(start, end) for start, end in self.overlapping_ranges(128)))
+
+        for start, end, response, body in asyncio.run(fetch_all()):
+            self.assert_exact(start, end, response, body)
+
+    def test_repeated_ranges_are_served_from_the_piece_cache(self):
+        pieces = self.ts.manager.alerts.pieces
+        self.read_range(0, None)
+        hits = pieces.stats()['hits']
+        response, body = self.read_range(self.piece_size // 2, 3 * self.piece_size)
+        self.assert_exact(self.piece_size // 2, 3 * self.piece_size, response, body)
+        self.assertGreaterEqual(pieces.stats()['hits'] - hits, 4)
@@ -4,6 +4,13 @@ from . import views
 urlpatterns = [
     path('', views.stream_torrent, name='stream_torrent'),
     path('init/', views.init_torrent_file, name='init_stream_torrent'),
+    path('status/', views.stream_status, name='stream_status'),
     path('movie/', views.stream_stored_movie, name='stream_stored_movie'),
     path('movies/list/', views.list_stored_movies, name='list_stored_movies'),
+    path('cache/', views.disk_cache_stats, name='disk_cache_stats'),
+    path('maintenance/', views.maintenance_stats, name='maintenance_stats'),
+    path('hls/', views.hls_playlist, name='hls_playlist'),
+    path('hls/segment/', views.hls_segment, name='hls_segment'),
+    path('hls/stats/', views.hls_stats, name='hls_stats'),
+    path('transcode/', views.transcode_stats, name='transcode_stats'),
 ]
@@ -1,78 +1,127 @@
 # from django.shortcuts import Response
-from django.http import HttpResponse, JsonResponse
-from .services.stream import TorrentStream, StoredMovieStream
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.urls import reverse
+from urllib.parse import urlencode
+from .services.stream import DIRECT, StoredMovieStream, VideoConverter
+from .services.registry import get_stream_registry
+from .services.cache import get_disk_cache
+from .services.maintenance import get_scheduler
+from .services.hls import get_hls_cache
+from .services.transcode import get_transcode_supervisor
+from .services.conversions import get_conversion_cache
+from .services.faststart import get_faststart_remuxer
+from .services.aio import stream_async
+from .services.daemon import daemon_view
+import asyncio
 import json
 import os
 from .services.utils import construct_magnet_link
 
-streams = {}
 
-def init_torrent_file(request):
+@daemon_view
+async def init_torrent_file(request):
     torrent_url = request.GET.get('torrent_url', None)
     torrent_hash = request.GET.get('torrent_hash', None)
     movie_name = request.GET.get('movie_name', None)
-    
+    file_index = request.GET.get('file_index', None)
+    if file_index is not None:
+        if not file_index.isdigit():
+            return JsonResponse({'status': 'error', 'message': 'file_index must be a non-negative integer!'}, status=400)
+        file_index = int(file_index)
+
     if torrent_hash and movie_name:
         magnet_url = construct_magnet_link(torrent_hash, movie_name)
         if not magnet_url:
             return JsonResponse({'status': 'error', 'message': 'Magnet URL is required!'}, status=400)
-        if torrent_hash in streams:
-            return JsonResponse({'status': 'error', 'message': 'Torrent file already added!', 'stream_id': torrent_hash})
-        ts = TorrentStream()
-
-        ts.add_torrent(magnet_url)
-        streams[torrent_hash] = ts
-        print(f"====> Stream ID: {torrent_hash}")
-        return JsonResponse({'status': 'success', 'message': 'Torrent file added successfully!', 'stream_id': torrent_hash})
+        stream_id = torrent_hash
+        source = {'magnet_link': magnet_url}
     else:
         if not torrent_url:
             return JsonResponse({'status': 'error', 'message': 'Torrent URL is required!'}, status=400)
-        ts = TorrentStream()
-        ts.init_torrent_file(torrent_url)
-        ts.add_torrent()
         stream_id = torrent_url.split('/')[-1].split('.')[0]
-        streams[stream_id] = ts
-        print(f"====> Stream ID: {stream_id}")
-        return JsonResponse({'status': 'success', 'message': 'Torrent file added successfully!', 'stream_id': stream_id})
+        source = {'torrent_url': torrent_url}
+    if file_index is not None:
+        stream_id = f"{stream_id}-{file_index}"
+
+    ts, created = await asyncio.to_thread(get_stream_registry().start, stream_id, source, file_index)
+    progress = await asyncio.to_thread(ts.progress)
+    if not created:
+        return JsonResponse({'status': 'error', 'message': 'Torrent file already added!', 'stream_id': stream_id, **progress})
+    print(f"====> Stream ID: {stream_id}")
+    return JsonResponse({'status': 'success', 'message': 'Torrent initialization started!', 'stream_id': stream_id, **progress}, status=202)
 
 
-def stream_torrent(request):
+@daemon_view
+def stream_status(request):
+    stream_id = request.GET.get('stream_id', None)
+    if not stream_id:
+        return JsonResponse({'status': 'error', 'message': 'stream_id is required!'}, status=400)
+
+    ts = get_stream_registry().get(stream_id)
+    if not ts:
+        return JsonResponse({'status': 'error', 'message': 'Stream not found!'}, status=404)
+    return JsonResponse({'status': 'success', 'stream_id': stream_id, **ts.progress(), 'torrent': ts.status()})
+
+
+@daemon_view
+async def stream_torrent(request):
     stream_id = request.GET.get('stream_id', None)
     if not stream_id:
         return JsonResponse({'status': 'error', 'message': 'stream_id is required!'}, status=400)
 
     vrange = request.headers.get('Range', 'bytes=0-')
-    ts = streams.get(stream_id)
+    ts = get_stream_registry().get(stream_id)
     print(f"====> Stream: {ts}")
     if not ts:
         return JsonResponse({'status': 'error', 'message': 'Stream not found!'}, status=404)
-    data = ts.stream_torrent(vrange)
+    try:
+        await ts.wait_until_started_async(settings.STREAM_METADATA_TIMEOUT)
+        # Opening a range sets piece priorities and deadlines: libtorrent calls, kept off the loop.
+        reader = await asyncio.to_thread(ts.open_range, vrange)
+        data = await reader.read_async()
+    except TimeoutError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=504)
+    except IOError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+    except ValueError as e:
+        response = JsonResponse({'status': 'error', 'message': str(e)}, status=416)
+        response['Content-Range'] = f"bytes */{ts.file_size}"
+        return response
 
-    response = ts.create_response(data)
+    response = reader.create_response(data)
     return response
 
 
-def stream_stored_movie(request):
-    movie_path = request.GET.get('movie_path', None)
+def resolve_movie_path(movie_path):
     if not movie_path:
-        return JsonResponse({'status': 'error', 'message': 'movie_path is required!'}, status=400)
+        return None, JsonResponse({'status': 'error', 'message': 'movie_path is required!'}, status=400)
 
     movie_path = os.path.normpath(movie_path).lstrip(os.sep)
     if '..' in movie_path or movie_path.startswith('/'):
-        return JsonResponse({'status': 'error', 'message': 'Invalid movie path!'}, status=400)
+        return None, JsonResponse({'status': 'error', 'message': 'Invalid movie path!'}, status=400)
 
     if not os.path.isabs(movie_path):
         movie_path = os.path.join('./_Movies', movie_path)
 
     if not os.path.exists(movie_path):
-        return JsonResponse({'status': 'error', 'message': 'Movie file not found!'}, status=404)
+        return None, JsonResponse({'status': 'error', 'message': 'Movie file not found!'}, status=404)
+    return movie_path, None
+
+
+@daemon_view
+async def stream_stored_movie(request):
+    movie_path, error = resolve_movie_path(request.GET.get('movie_path', None))
+    if error:
+        return error
 
     range_header = request.headers.get('Range')
 
     try:
         movie_stream = StoredMovieStream(movie_path)
 
-        response = movie_stream.create_streaming_response(range_header)
+        # Opening the range may wait for a conversion; the body is then read chunk by chunk.
+        response = stream_async(await asyncio.to_thread(movie_stream.create_streaming_response, range_header))
 
         print(f"====> Streaming movie: {movie_path}")
         print(f"====> Content-Type: {response.get('Content-Type')}")
@@ -80,11 +129,17 @@ def stream_stored_movie(request):
 
         return response
 
+    except TimeoutError as e:
+        # Waiting for a conversion to reach the requested byte.
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=504)
+    except IOError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
     except Exception as e:
         print(f"Error streaming movie: {str(e)}")
         return JsonResponse({'status': 'error', 'message': f'Error streaming movie: {str(e)}'}, status=500)
 
 
+@daemon_view
 def list_stored_movies(request):
     movies_dir = './_Movies'
     movies = []
@@ -92,17 +147,20 @@ def list_stored_movies(request):
     try:
         for item in os.listdir(movies_dir):
             item_path = os.path.join(movies_dir, item)
-            if os.path.isdir(item_path):
+            # Hidden directories hold conversions and HLS segments, not titles.
+            if os.path.isdir(item_path) and not item.startswith('.'):
                 for file in os.listdir(item_path):
                     if file.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.m4v', '.webm', '.ogg')):
                         relative_path = os.path.join(item, file)
                         file_size = os.path.getsize(os.path.join(item_path, file))
+                        conversion = VideoConverter.plan(os.path.join(item_path, file), wait=False)
                         movies.append({
                             'name': file,
                             'path': relative_path,
                             'size': file_size,
                             'directory': item,
-                            'needs_conversion': file.lower().endswith(('.mkv', '.avi', '.mov', '.wmv', '.flv', '.m4v'))
+                            'needs_conversion': conversion != DIRECT,
+                            'conversion': conversion,
                         })
         
         return JsonResponse({'status': 'success', 'movies': movies})
@@ -110,3 +168,87 @@ def list_stored_movies(request):
     except Exception as e:
         print(f"Error listing movies: {str(e)}")
         return JsonResponse({'status': 'error', 'message': f'Error listing movies: {str(e)}'}, status=500)
+
+
+@daemon_view
+def disk_cache_stats(request):
+    return JsonResponse({'status': 'success', 'cache': get_disk_cache().stats()})
+
+
+@daemon_view
+def maintenance_stats(request):
+    return JsonResponse({'status': 'success', 'jobs': get_scheduler().stats()})
+
+
+def resolve_hls_title(request):
+    # Returns the title's movie path, the ffmpeg input and the query identifying it.
+    stream_id = request.GET.get('stream_id', None)
+    if not stream_id:
+        movie_path, error = resolve_movie_path(request.GET.get('movie_path', None))
+        return movie_path, movie_path, {'movie_path': request.GET.get('movie_path')}, error
+
+    ts = get_stream_registry().get(stream_id)
+    if not ts:
+        return None, None, None, JsonResponse({'status': 'error', 'message': 'Stream not found!'}, status=404)
+    ts.wait_until_started(settings.STREAM_METADATA_TIMEOUT)
+    ts.touch()
+    if ts.is_complete():
+        source = ts.movie_path
+    else:
+        # Read through the range endpoint so the pieces ffmpeg needs are fetched first.
+        source = request.build_absolute_uri(reverse('stream_torrent')) + '?' + urlencode({'stream_id': stream_id})
+    return ts.movie_path, source, {'stream_id': stream_id}, None
+
+
+@daemon_view
+def hls_playlist(request):
+    try:
+        movie_path, source, query, error = resolve_hls_title(request)
+        if error:
+            return error
+        transcoder = get_hls_cache().transcoder(movie_path, source)
+    except TimeoutError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=504)
+    except IOError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+
+    playlist = transcoder.playlist(lambda number: f"segment/?{urlencode({**query, 'n': number})}")
+    response = HttpResponse(playlist, content_type='application/vnd.apple.mpegurl')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@daemon_view
+async def hls_segment(request):
+    number = request.GET.get('n', '')
+    if not number.isdigit():
+        return JsonResponse({'status': 'error', 'message': 'n must be a non-negative integer!'}, status=400)
+    try:
+        movie_path, source, query, error = await asyncio.to_thread(resolve_hls_title, request)
+        if error:
+            return error
+        transcoder = await asyncio.to_thread(get_hls_cache().transcoder, movie_path, source)
+        segment_path = await transcoder.segment(int(number), settings.STREAM_HLS_SEGMENT_TIMEOUT)
+    except TimeoutError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=504)
+    except IOError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=404)
+
+    # Finished segments never change, so clients and proxies may keep them.
+    response = FileResponse(open(segment_path, 'rb'), content_type='video/mp2t')
+    response['Cache-Control'] = 'public, max-age=86400'
+    return stream_async(response)
+
+
+@daemon_view
+def hls_stats(request):
+    return JsonResponse({'status': 'success', 'transcoders': get_hls_cache().stats()})
+
+
+@daemon_view
+def transcode_stats(request):
+    return JsonResponse({'status': 'success', 'transcode': get_transcode_supervisor().stats(),
+                         'conversions': get_conversion_cache().stats(),
+                         'faststart': get_faststart_remuxer().stats()})